@@ -0,0 +1,154 @@
+from typing import Optional, Tuple
+import numpy as np
+from sklearn.preprocessing import normalize
+from .ranking import top_n, count_matches
+
+# inverted file index (IVF) over normalized document vectors: documents are
+# grouped around coarse k-means centroids and query scores only documents
+# from nprobe lists whose centroids are closest to it, optionally using
+# product quantization (PQ) to preselect candidates before exact scoring
+
+ASSIGN_CHUNK = 4096
+
+
+def default_n_lists(n_docs: int) -> int:
+    # square root of number of documents
+    return max(1, int(np.sqrt(n_docs)))
+
+
+def _assign(X: "np.array", centroids: "np.array", spherical: bool) -> "np.array":
+    # returns index of closest centroid for each row of X
+    assignment = np.empty(X.shape[0], dtype=np.int64)
+    sq_norms = None if spherical else (centroids ** 2).sum(axis=1)
+    for start in range(0, X.shape[0], ASSIGN_CHUNK):
+        products = X[start:start+ASSIGN_CHUNK] @ centroids.T
+        if spherical:
+            assignment[start:start+ASSIGN_CHUNK] = products.argmax(axis=1)
+        else:
+            assignment[start:start+ASSIGN_CHUNK] = (sq_norms - 2 * products).argmin(axis=1)
+    return assignment
+
+
+def _kmeans(X: "np.array", n_clusters: int, n_iter: int, rng: "np.random.Generator",
+            spherical: bool) -> "np.array":
+    # trained on sample of X, spherical uses cosine similarity and normalized centroids
+    sample = X[np.sort(rng.choice(X.shape[0], min(X.shape[0], 64 * n_clusters), replace=False))]
+    sample = np.asarray(sample, dtype=np.float32)
+    centroids = sample[rng.choice(sample.shape[0], n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignment = _assign(sample, centroids, spherical)
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=n_clusters)
+        non_empty = counts > 0
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[non_empty]
+
+        # empty clusters keep their previous centroids
+        sums = np.add.reduceat(sample[order], starts, axis=0)
+        if spherical:
+            centroids[non_empty] = normalize(sums)
+        else:
+            centroids[non_empty] = sums / counts[non_empty, np.newaxis]
+
+    return centroids
+
+
+def _train_pq(X: "np.array", n_subspaces: int, n_iter: int,
+              rng: "np.random.Generator") -> Tuple["np.array", "np.array"]:
+    # returns (m, c, k/m) codebooks and (N, m) codes of rows of X
+    # raises ValueError if dimension isn't divisible by number of subspaces
+    dim = X.shape[1]
+    if dim % n_subspaces != 0:
+        raise ValueError(
+            f'dimension {dim} is not divisible by {n_subspaces} subspaces')
+
+    sub = dim // n_subspaces
+    n_codes = min(256, X.shape[0])
+    codebooks = np.stack([_kmeans(X[:, j*sub:(j+1)*sub], n_codes, n_iter, rng, spherical=False)
+                          for j in range(n_subspaces)])
+    codes = np.stack([_assign(X[:, j*sub:(j+1)*sub], codebooks[j], spherical=False)
+                      for j in range(n_subspaces)], axis=1).astype(np.uint8)
+
+    return codebooks, codes
+
+
+class IVFIndex:
+    def __init__(self, centroids: "np.array", list_offsets: "np.array", doc_idxs: "np.array",
+                 codebooks: Optional["np.array"] = None, codes: Optional["np.array"] = None) -> None:
+        self.centroids = centroids
+        # documents of list l are doc_idxs[list_offsets[l]:list_offsets[l+1]]
+        self.list_offsets = list_offsets
+        self.doc_idxs = doc_idxs
+        # PQ codes are ordered like doc_idxs
+        self.codebooks = codebooks
+        self.codes = codes
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def n_docs(self) -> int:
+        return self.doc_idxs.shape[0]
+
+    def built_with(self, n_docs: int, n_lists: int = None, pq_subspaces: int = 0) -> bool:
+        # whether build with these arguments would give index of same shape
+        n_lists = default_n_lists(n_docs) if n_lists is None else min(n_lists, n_docs)
+        subspaces = 0 if self.codebooks is None else self.codebooks.shape[0]
+        return self.n_docs == n_docs and self.n_lists == n_lists and subspaces == pq_subspaces
+
+    @classmethod
+    def build(cls, doc_vectors: "np.array", n_lists: int = None, pq_subspaces: int = 0,
+              n_iter: int = 10, seed: int = 0) -> "IVFIndex":
+        # n_lists defaults to square root of number of documents, 0 pq_subspaces disables PQ
+        N = doc_vectors.shape[0]
+        n_lists = default_n_lists(N) if n_lists is None else min(n_lists, N)
+        rng = np.random.default_rng(seed)
+
+        centroids = _kmeans(doc_vectors, n_lists, n_iter, rng, spherical=True)
+        assignment = _assign(doc_vectors, centroids, spherical=True)
+        doc_idxs = np.argsort(assignment, kind='stable')
+        list_offsets = np.concatenate(
+            ([0], np.cumsum(np.bincount(assignment, minlength=n_lists))))
+
+        codebooks, codes = None, None
+        if pq_subspaces > 0:
+            codebooks, codes = _train_pq(
+                doc_vectors[doc_idxs], pq_subspaces, n_iter, rng)
+
+        return cls(centroids, list_offsets, doc_idxs, codebooks, codes)
+
+    def to_arrays(self) -> tuple:
+        arrays = (self.centroids, self.list_offsets, self.doc_idxs)
+        if self.codes is not None:
+            arrays += (self.codebooks, self.codes)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: tuple) -> "IVFIndex":
+        return cls(*arrays)
+
+    def search(self, query_vector: "np.array", n: int, nprobe: int, doc_vectors: "np.array",
+               zero_tolerance: float, rerank: int = 4) -> Tuple["np.array", "np.array", int]:
+        # returns at most n best documents from nprobe closest lists ordered like
+        # ranking.top_n, their similarities and count of matches among scored documents
+        # with PQ only rerank * n best approximated documents are scored exactly
+        nprobe = min(max(nprobe, 1), self.n_lists)
+        list_scores = self.centroids @ query_vector
+        probed = np.argpartition(-list_scores, nprobe - 1)[:nprobe]
+        positions = np.concatenate([np.arange(self.list_offsets[l], self.list_offsets[l+1])
+                                    for l in probed])
+
+        if self.codes is not None:
+            n_subspaces, _, sub = self.codebooks.shape
+            # lookup tables of inner products of query parts with codewords
+            tables = np.einsum('mcs,ms->mc', self.codebooks,
+                               query_vector.reshape(n_subspaces, sub))
+            approx = tables[np.arange(n_subspaces), self.codes[positions]].sum(axis=1)
+            positions = positions[top_n(approx, rerank * n)]
+
+        candidates = np.sort(self.doc_idxs[positions])
+        scores = doc_vectors[candidates] @ query_vector
+        best = top_n(scores, n)
+
+        return candidates[best], scores[best], count_matches(scores, zero_tolerance)
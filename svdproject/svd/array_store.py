@@ -0,0 +1,91 @@
+from typing import Any, Dict
+import json
+import os
+import shutil
+import numpy as np
+import scipy.sparse as sparse
+
+# Directory format for matrices: each array is stored as raw .npy file and
+# manifest.json describes how to put them back together. Arrays are opened
+# memory mapped, so loading costs nothing until pages are touched and
+# the OS page cache is shared by every process that opens them.
+
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 1
+SPARSE_KINDS = {
+    'csc': sparse.csc_matrix,
+    'csr': sparse.csr_matrix
+}
+
+
+def _save_item(path: str, name: str, item: Any) -> Dict[str, Any]:
+    if sparse.issparse(item):
+        kind = item.format if item.format in SPARSE_KINDS else 'csc'
+        item = SPARSE_KINDS[kind](item)
+        arrays = {}
+        for part in ('data', 'indices', 'indptr'):
+            filename = f'{name}_{part}.npy'
+            np.save(os.path.join(path, filename), getattr(item, part))
+            arrays[part] = filename
+        return {'kind': kind, 'shape': list(item.shape), 'arrays': arrays}
+
+    filename = f'{name}.npy'
+    np.save(os.path.join(path, filename), np.ascontiguousarray(item))
+    return {'kind': 'dense', 'file': filename}
+
+
+def _load_item(path: str, entry: Dict[str, Any], mmap_mode: str) -> Any:
+    if entry['kind'] == 'dense':
+        return np.load(os.path.join(path, entry['file']), mmap_mode=mmap_mode)
+
+    data, indices, indptr = (np.load(os.path.join(path, entry['arrays'][part]), mmap_mode=mmap_mode)
+                             for part in ('data', 'indices', 'indptr'))
+    # arrays are used as they are, without copying
+    return SPARSE_KINDS[entry['kind']]((data, indices, indptr), shape=tuple(entry['shape']),
+                                       copy=False)
+
+
+def save_arrays(path: str, obj: Any) -> None:
+    # obj is np.array, sparse matrix or tuple of them
+    # directory is written next to path and swapped in when complete
+    path = str(path)
+    tmp_path = f'{path}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.mkdir(tmp_path)
+
+    if isinstance(obj, tuple):
+        manifest = {'kind': 'tuple',
+                    'items': [_save_item(tmp_path, str(i), item) for i, item in enumerate(obj)]}
+    else:
+        manifest = _save_item(tmp_path, 'array', obj)
+    manifest['version'] = FORMAT_VERSION
+
+    with open(os.path.join(tmp_path, MANIFEST), 'w') as f:
+        json.dump(manifest, f)
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+def load_arrays(path: str, mmap_mode: str = 'r') -> Any:
+    # raises FileNotFoundError if path wasn't saved with save_arrays
+    # returned arrays are read only with default mmap_mode
+    path = str(path)
+    with open(os.path.join(path, MANIFEST), 'r') as f:
+        manifest = json.load(f)
+
+    if manifest['version'] != FORMAT_VERSION:
+        raise ValueError(
+            f'unsupported format version {manifest["version"]} of {path}')
+
+    if manifest['kind'] == 'tuple':
+        return tuple(_load_item(path, entry, mmap_mode) for entry in manifest['items'])
+
+    return _load_item(path, manifest, mmap_mode)
+
+
+def is_array_dir(path: str) -> bool:
+    return os.path.isfile(os.path.join(str(path), MANIFEST))
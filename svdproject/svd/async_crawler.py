@@ -0,0 +1,243 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+import asyncio
+import os
+import time
+import aiohttp
+from requests_html import HTML
+from .crawler import (URL_PREFIX, STARTING_POINT, VALID_ROOT, RESULTS_DIR, PICKLE_DIR, LIMIT,
+                      ALREADY_SEEN_FN, extract_text_content, extract_feature_links, unpickle_utils)
+from .frontier import CrawlFrontier
+from .token_shards import ShardWriter
+from . import preprocessor
+from .preprocessor import Preprocessor, FT, encode_url
+
+# Crawler running on single event loop: pages are fetched by pooled aiohttp
+# client with bounded number of concurrent requests and per host rate limit,
+# parsed on process pool, so the loop never waits on lxml. Routes to crawl
+# and seen routes are kept in durable frontier (see frontier.py).
+# Optionally saved articles are also tokenized by the pool and streamed into
+# token shards (see token_shards.py), that can be indexed without preprocessing.
+
+CONCURRENCY = 32
+# requests per second to one host
+RATE_LIMIT = 10.0
+TIMEOUT = 30.0
+RETRIES = 2
+USER_AGENT = 'searchvd-crawler'
+FRONTIER_FN = 'crawl_frontier.sqlite3'
+# routes leased from frontier at once
+FRONTIER_BATCH = 256
+
+
+def parse_page(page: str, url: str, tokenize: bool = False) -> Tuple[Optional[str], List[str],
+                                                                     Optional[List[str]]]:
+    # runs in pool worker, returns text content (None if page has none), links
+    # and if tokenize is set preprocessed tokens of content, pool has to be
+    # initialized with preprocessor._init_worker then
+    html = HTML(html=page, url=url)
+    text = extract_text_content(html)
+    tokens = None
+    if tokenize and text is not None:
+        tokens = preprocessor._worker_preproc._preprocess_doc(text)
+    return text, list(extract_feature_links(html)), tokens
+
+
+class HostRateLimiter:
+    # spaces requests to each host at least 1 / rate seconds apart
+    def __init__(self, rate: float) -> None:
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_slot: Dict[str, float] = {}
+
+    async def wait(self, host: str) -> None:
+        # event loop runs one coroutine at a time, so no lock is needed
+        now = time.monotonic()
+        slot = max(now, self.next_slot.get(host, now))
+        self.next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class AsyncCrawler:
+    def __init__(self, url_prefix: str = URL_PREFIX, valid_root: str = VALID_ROOT,
+                 results_dir: str = RESULTS_DIR, limit: int = LIMIT, concurrency: int = CONCURRENCY,
+                 rate_limit: float = RATE_LIMIT, parse_workers: int = None,
+                 timeout: float = TIMEOUT, retries: int = RETRIES, shard_dir: str = None,
+                 preproc: Preprocessor = None) -> None:
+        # limit is number of saved documents, it might be slightly exceeded,
+        # 0 rate_limit disables rate limiting, parse_workers defaults to number of cores,
+        # with shard_dir saved documents are tokenized like preproc does it and
+        # appended to token shards there
+        self.url_prefix = url_prefix
+        self.valid_root = valid_root
+        self.results_dir = results_dir
+        self.limit = limit
+        self.concurrency = concurrency
+        self.rate_limiter = HostRateLimiter(rate_limit)
+        self.parse_workers = parse_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.shard_dir = shard_dir
+        self.preproc = preproc
+        self.saved = 0
+        self.fetched = 0
+        self.failed = 0
+
+    def _route(self, href: str) -> Optional[str]:
+        # route of link if it should be crawled
+        if href.startswith(self.url_prefix):
+            href = href[len(self.url_prefix):]
+        return href if href.startswith(self.valid_root) else None
+
+    def _save(self, url: str, text: str) -> None:
+        with open(os.path.join(self.results_dir, encode_url(url)), 'w') as out:
+            out.write(text)
+
+    async def _fetch(self, session: aiohttp.ClientSession, url: str) -> Optional[str]:
+        # returns html of page, None if it isn't html or couldn't be fetched
+        for attempt in range(self.retries + 1):
+            await self.rate_limiter.wait(urlsplit(url).netloc)
+            try:
+                async with session.get(url) as r:
+                    if r.status >= 500 and attempt < self.retries:
+                        continue
+                    if r.status != 200 or r.content_type != 'text/html':
+                        return None
+                    return await r.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    print(f'failed to fetch {url}: {e!r}')
+        return None
+
+    async def _crawl_route(self, route: str, session: aiohttp.ClientSession,
+                           pool: ProcessPoolExecutor) -> None:
+        url = f'{self.url_prefix}{route}'
+        page = await self._fetch(session, url)
+        if page is None:
+            self.failed += 1
+            return
+        self.fetched += 1
+
+        loop = asyncio.get_running_loop()
+        text, hrefs, tokens = await loop.run_in_executor(
+            pool, parse_page, page, url, self.shards is not None)
+
+        routes = (self._route(href) for href in hrefs)
+        self.frontier.add(route for route in routes if route is not None)
+
+        if text is not None:
+            await loop.run_in_executor(None, self._save, url, text)
+            if self.shards is not None:
+                self.shards.append(encode_url(url), tokens)
+            self.saved += 1
+            print(f'fetched data from {url} ({self.saved} saved)')
+
+    async def _next_route(self) -> Optional[str]:
+        # None when limit is reached or nothing is queued and nothing is being
+        # crawled (so nothing can be queued anymore)
+        while True:
+            if self.saved >= self.limit:
+                return None
+            if len(self.buffer) == 0:
+                self.buffer.extend(self.frontier.pop(FRONTIER_BATCH))
+            if len(self.buffer) > 0:
+                self.in_flight += 1
+                return self.buffer.popleft()
+            if self.in_flight == 0:
+                return None
+            self.changed.clear()
+            await self.changed.wait()
+
+    async def _worker(self, session: aiohttp.ClientSession, pool: ProcessPoolExecutor) -> None:
+        while True:
+            route = await self._next_route()
+            if route is None:
+                # wakes up workers waiting for routes, so they can finish too
+                self.changed.set()
+                return
+            try:
+                await self._crawl_route(route, session, pool)
+            except Exception as e:
+                print(f'failed to crawl {route}: {e!r}')
+                self.failed += 1
+            finally:
+                self.frontier.done(route)
+                self.in_flight -= 1
+                self.changed.set()
+
+    async def crawl(self, frontier: CrawlFrontier) -> int:
+        # crawls until frontier runs out or limit is reached, returns number of saved documents
+        self.frontier = frontier
+        self.buffer = deque()
+        self.in_flight = 0
+        self.changed = asyncio.Event()
+
+        pool_options = {}
+        self.shards = None
+        if self.shard_dir is not None:
+            preproc = Preprocessor() if self.preproc is None else self.preproc
+            pool_options = {'initializer': preprocessor._init_worker, 'initargs': (preproc.config(),)}
+            self.shards = ShardWriter(self.shard_dir)
+
+        start = time.time()
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         headers={'User-Agent': USER_AGENT}) as session:
+            with ProcessPoolExecutor(self.parse_workers, **pool_options) as pool:
+                workers = [asyncio.create_task(self._worker(session, pool))
+                           for _ in range(self.concurrency)]
+                try:
+                    await asyncio.gather(*workers)
+                finally:
+                    for worker in workers:
+                        worker.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+                    # leased but not crawled, routes being crawled when interrupted
+                    # are released when frontier is opened again
+                    frontier.release(self.buffer)
+                    # documents of shard lost by crash are still in results dir
+                    # and get indexed by ingest_new_documents
+                    if self.shards is not None:
+                        self.shards.close()
+                    frontier.checkpoint()
+
+        time_taken = time.time() - start
+        print(f'saved {self.saved} documents, fetched {self.fetched} pages, {self.failed} failed ' +
+              f'in {round(time_taken, 2)}s ({round(self.fetched / max(time_taken, 1e-9), 1)} pages/s)')
+        return self.saved
+
+
+def async_crawler(starting_point: str = STARTING_POINT, stream_tokens: bool = False, **options) -> int:
+    # crawls with frontier stored in pickle dir, state pickled by crawler.py is
+    # imported when frontier is created, starting_point is queued if it wasn't seen yet,
+    # options are passed to AsyncCrawler, with stream_tokens documents are streamed
+    # into token shards in pickle dir, where preprocessor looks for them by default
+    if not os.path.isdir(PICKLE_DIR):
+        os.mkdir(PICKLE_DIR)
+
+    results_dir = options.get('results_dir', RESULTS_DIR)
+    if not os.path.isdir(results_dir):
+        os.mkdir(results_dir)
+
+    path = os.path.join(PICKLE_DIR, FRONTIER_FN)
+    is_new = not os.path.isfile(path)
+    frontier = CrawlFrontier(path)
+    try:
+        if is_new and os.path.isfile(os.path.join(PICKLE_DIR, ALREADY_SEEN_FN)):
+            print('migrating pickled crawl state...')
+            frontier.migrate(*unpickle_utils())
+        frontier.add([starting_point])
+        if stream_tokens and options.get('shard_dir') is None:
+            preproc = options.setdefault('preproc', Preprocessor())
+            options['shard_dir'] = str(preproc.paths[FT.token_shards])
+        return asyncio.run(AsyncCrawler(**options).crawl(frontier))
+    finally:
+        frontier.close()
+
+
+if __name__ == '__main__':
+    async_crawler()
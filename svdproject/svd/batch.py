@@ -0,0 +1,86 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+from typing import Any, Dict, Iterator, List
+import json
+import time
+import numpy as np
+from .preprocessor import Preprocessor
+from .search_engine import SearchEngine, Mode
+from .ranking import top_n, count_matches
+
+
+def read_queries(path: str) -> Iterator[str]:
+    # one query per line, empty lines are skipped
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if len(line) > 0:
+                yield line
+
+
+class BatchRunner:
+    # scores whole batches of queries with one matrix product per mode,
+    # top k selection and snippets of each query run on thread pool
+    def __init__(self, se: SearchEngine, k: int = 20, batch_size: int = 256,
+                 n_workers: int = None, snippets: bool = True) -> None:
+        self.se = se
+        self.k = k
+        self.batch_size = batch_size
+        self.n_workers = n_workers
+        self.snippets = snippets
+
+    def _result(self, query: str, found: bool, similarities: "np.array",
+                preproc: Preprocessor) -> Dict[str, Any]:
+        if not found:
+            return {'query': query, 'error': 'query contains no indexed terms'}
+
+        doc_idxs = top_n(similarities, self.k)
+        result = {
+            'query': query,
+            'doc_idxs': doc_idxs.tolist(),
+            'correlations': similarities[doc_idxs].tolist(),
+            'results_count': count_matches(similarities, self.se.zero_tolerance)
+        }
+
+        if self.snippets:
+            docs = list(preproc.get_original_documents(
+                doc_idxs, self.se.max_doc_len))
+            result['links'], result['titles'], result['contents'] = (
+                zip(*docs) if len(docs) > 0 else ((), (), ()))
+
+        return result
+
+    def _batches(self, queries: Iterator[str]) -> Iterator[List[str]]:
+        batch = []
+        for query in queries:
+            batch.append(query)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
+    def run(self, in_path: str, out_path: str, mode: Mode = Mode.SVD_IDF) -> int:
+        # writes one json line per query to out_path in input order, returns number of queries
+        count = 0
+        start = time.time()
+
+        with open(out_path, 'w') as out, ThreadPoolExecutor(self.n_workers) as pool:
+            for batch in self._batches(read_queries(in_path)):
+                # whole batch uses same version of index
+                snapshot = self.se.snapshot
+                Q, found = snapshot.preproc.queries2matrix(batch)
+                similarities = self.se.score_batch(Q, mode, snapshot)
+
+                for result in pool.map(self._result, batch, found, similarities,
+                                       repeat(snapshot.preproc)):
+                    out.write(json.dumps(result) + '\n')
+
+                count += len(batch)
+                print(f'processed {count} queries')
+
+        time_taken = time.time() - start
+        print(f'processed {count} queries in {np.around(time_taken, 2)}s ' +
+              f'({np.around(count / max(time_taken, 1e-9), 1)} queries/s), results saved at {out_path}')
+
+        return count
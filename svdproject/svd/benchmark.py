@@ -0,0 +1,184 @@
+from typing import Any, Callable, Dict, List
+import os
+import platform
+import re
+import time
+import numpy as np
+import scipy
+from .preprocessor import Preprocessor, encode_url
+from .search_engine import SearchEngine, Mode
+
+# Benchmarks of index building stages and query latency on synthetic corpus,
+# runs offline: documents are generated, tokenized with simple regex tokenizer
+# and stop words are most frequent synthetic words.
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'te', 'vo', 'zi', 'po',
+             'da', 'fe', 'gu', 'hi', 'jo', 'be', 'ko', 'la', 'mu', 'ni',
+             'ra', 'se', 'ti', 'vu', 'ze', 'pa', 'do', 'fi', 'go', 'he']
+GENERATE_CHUNK = 10_000
+N_STOP_WORDS = 20
+
+
+def simple_tokenize(text: str) -> List[str]:
+    return re.findall(r'\w+|[^\w\s]', text)
+
+
+def synthetic_word(rank: int) -> str:
+    # distinct word of at least two syllables for every rank
+    rank += len(SYLLABLES)
+    syllables = []
+    while rank > 0:
+        rank, digit = divmod(rank, len(SYLLABLES))
+        syllables.append(SYLLABLES[digit])
+    return ''.join(reversed(syllables))
+
+
+def default_vocab_size(n_docs: int) -> int:
+    # grows sublinearly with corpus like real vocabularies (Heaps' law)
+    return int(40 * n_docs ** 0.6)
+
+
+class ZipfSampler:
+    # samples word ranks with probability proportional to 1 / (rank + 1) ** s
+    def __init__(self, vocab_size: int, s: float = 1.1) -> None:
+        weights = 1.0 / np.arange(1, vocab_size + 1) ** s
+        self.cdf = np.cumsum(weights / weights.sum())
+        self.cdf[-1] = 1.0
+        self.words = [synthetic_word(rank) for rank in range(vocab_size)]
+
+    def sample(self, rng: "np.random.Generator", size: int) -> "np.array":
+        return np.searchsorted(self.cdf, rng.random(size), side='right')
+
+
+def generate_corpus(path: str, n_docs: int, vocab_size: int = None, min_len: int = 50,
+                    max_len: int = 400, s: float = 1.1, seed: int = 0) -> ZipfSampler:
+    # writes n_docs documents in raw data format (url encoded name, title on first line)
+    # to path, same arguments always give same corpus
+    os.makedirs(path, exist_ok=True)
+    vocab_size = default_vocab_size(n_docs) if vocab_size is None else vocab_size
+    sampler = ZipfSampler(vocab_size, s)
+    rng = np.random.default_rng(seed)
+
+    for start in range(0, n_docs, GENERATE_CHUNK):
+        lengths = rng.integers(min_len, max_len + 1, min(GENERATE_CHUNK, n_docs - start))
+        ranks = sampler.sample(rng, lengths.sum())
+        ends = np.cumsum(lengths)
+
+        for i, (doc_start, doc_end) in enumerate(zip(ends - lengths, ends)):
+            words = [sampler.words[rank] for rank in ranks[doc_start:doc_end]]
+            title = ' '.join(words[:6]).capitalize()
+            name = encode_url(f'https://bench.local/doc/{start + i}')
+            with open(os.path.join(path, name), 'w') as f:
+                f.write(f'{title}\n{" ".join(words)}.')
+
+    return sampler
+
+
+def generate_queries(sampler: ZipfSampler, n_queries: int, max_terms: int = 4,
+                     seed: int = 0) -> List[str]:
+    # queries of 1 to max_terms words, stop words excluded
+    rng = np.random.default_rng(seed + 1)
+    queries = []
+    for n_terms in rng.integers(1, max_terms + 1, n_queries):
+        ranks = sampler.sample(rng, 4 * n_terms)
+        ranks = ranks[ranks >= N_STOP_WORDS][:n_terms]
+        queries.append(' '.join(sampler.words[rank] for rank in ranks) or sampler.words[-1])
+    return queries
+
+
+def latency_stats(latencies: List[float]) -> Dict[str, float]:
+    # in milliseconds
+    latencies = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'count': len(latencies),
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'max_ms': float(latencies.max())
+    }
+
+
+def _timed(stages: Dict[str, float], name: str, f: Callable[[], Any]) -> Any:
+    start = time.perf_counter()
+    result = f()
+    stages[name] = time.perf_counter() - start
+    print(f'{name} took {np.around(stages[name], 3)}s')
+    return result
+
+
+def run_benchmark(work_dir: str, n_docs: int, k: int = 100, n_queries: int = 200,
+                  vocab_size: int = None, seed: int = 0, n_jobs: int = 1,
+                  solver: str = 'arpack', approximate: bool = True, n_shards: int = 1) -> Dict[str, Any]:
+    # builds index of synthetic corpus in work_dir and queries it in every mode,
+    # returns configuration, seconds taken by each build stage and query latencies
+    raw_dir = os.path.join(work_dir, 'raw')
+    pickle_dir = os.path.join(work_dir, 'pickled')
+    os.makedirs(pickle_dir, exist_ok=True)
+    stages = {}
+
+    sampler = _timed(stages, 'generate_corpus', lambda: generate_corpus(
+        raw_dir, n_docs, vocab_size, seed=seed))
+    preproc = Preprocessor(stop_words=sampler.words[:N_STOP_WORDS], svd_max_order=k,
+                           svd_solver=solver, tokenizer=simple_tokenize,
+                           raw_data_dir=raw_dir, pickle_dir=pickle_dir)
+
+    _timed(stages, 'index_documents', preproc.index_documents)
+    _timed(stages, 'preprocess_docs', lambda: preproc.preprocess_docs(n_jobs=n_jobs))
+    _timed(stages, 'build_tbd_matrix', preproc.build_tbd_matrix)
+    _timed(stages, 'build_tbd_idf_matrix', preproc.build_tbd_idf_matrix)
+    _timed(stages, 'build_tbd_svd_matrix', lambda: preproc.build_tbd_svd_matrix(k))
+    _timed(stages, 'build_tbd_idf_svd_matrix', lambda: preproc.build_tbd_idf_svd_matrix(k))
+
+    if approximate:
+        _timed(stages, 'build_ann_index', lambda: preproc.load_ann_indices(k))
+
+    se = _timed(stages, 'load_engine', lambda: SearchEngine(k=k, preproc=preproc, n_shards=n_shards,
+                                                                       ann_lists=None if approximate else 0))
+
+    queries = generate_queries(sampler, n_queries, seed=seed)
+    runs = [(mode.name, mode, False) for mode in Mode]
+    if approximate:
+        runs.append((f'{Mode.SVD_IDF.name}_approx', Mode.SVD_IDF, True))
+
+    latencies = {}
+    for name, mode, approx in runs:
+        times = []
+        for query in queries:
+            # rankings aren't served from cache, so every query is scored
+            se.ranking_cache.clear()
+            start = time.perf_counter()
+            try:
+                se.handle_query(query, mode=mode, approximate=approx)
+            except AttributeError:
+                continue
+            times.append(time.perf_counter() - start)
+        latencies[name] = latency_stats(times)
+        print(f'{name}: p50 {np.around(latencies[name]["p50_ms"], 2)}ms, ' +
+              f'p99 {np.around(latencies[name]["p99_ms"], 2)}ms')
+
+    tbd_matrix = preproc.get_tbd_matrix()
+    return {
+        'config': {
+            'n_docs': n_docs,
+            'n_terms': tbd_matrix.shape[0],
+            'nnz': int(tbd_matrix.nnz),
+            'vocab_size': len(sampler.words),
+            'k': k,
+            'n_queries': n_queries,
+            'seed': seed,
+            'n_jobs': n_jobs,
+            'solver': solver,
+            'n_shards': n_shards
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count()
+        },
+        'stages_s': stages,
+        'queries': latencies
+    }
@@ -0,0 +1,164 @@
+from collections import deque
+from typing import Iterable, List, Set
+import hashlib
+import math
+import os
+import sqlite3
+import time
+import numpy as np
+
+# Crawl frontier kept in SQLite: routes waiting to be crawled and every route
+# ever queued (exact seen store). Bloom filter in memory answers most "was it
+# seen?" questions for new routes without touching disk, only its possible
+# positives are checked in the seen table. Changes are committed and the filter
+# saved at checkpoints, after restart crawl resumes from the last one.
+
+QUEUED = 0
+LEASED = 1
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 1e-3, bits: "np.array" = None) -> None:
+        # sized for capacity items with false positive rate error_rate,
+        # exceeding capacity only makes false positives more likely
+        self.n_bits = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, round(self.n_bits / capacity * math.log(2)))
+        self.bits = np.zeros((self.n_bits + 7) // 8, dtype=np.uint8) if bits is None else bits
+
+    def _positions(self, item: str) -> List[int]:
+        # double hashing, k positions from two 64 bit hashes
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def add(self, item: str) -> None:
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class CrawlFrontier:
+    def __init__(self, path: str, capacity: int = 10_000_000, error_rate: float = 1e-3,
+                 checkpoint_every: int = 1000, checkpoint_interval: float = 30.0) -> None:
+        # checkpoint is made after checkpoint_every changes or checkpoint_interval seconds
+        self.path = path
+        self.bloom_path = f'{path}.bloom.npy'
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_interval = checkpoint_interval
+        self.changes = 0
+        self.last_checkpoint = time.time()
+
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS seen (route TEXT PRIMARY KEY) WITHOUT ROWID')
+        self.db.execute('CREATE TABLE IF NOT EXISTS frontier (id INTEGER PRIMARY KEY AUTOINCREMENT, ' +
+                        'route TEXT NOT NULL, state INTEGER NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS frontier_state ON frontier (state, id)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)')
+        # routes leased by crawl that didn't finish are crawled again
+        self.db.execute('UPDATE frontier SET state = ? WHERE state = ?', (QUEUED, LEASED))
+        self.db.commit()
+
+        # kept up to date by inserts, so checkpoints don't count whole table
+        self.seen = self.db.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+        self.bloom = self._load_bloom(capacity, error_rate)
+
+    def _insert_seen(self, route: str) -> None:
+        self.bloom.add(route)
+        self.db.execute('INSERT INTO seen (route) VALUES (?)', (route,))
+        self.seen += 1
+
+    def _load_bloom(self, capacity: int, error_rate: float) -> BloomFilter:
+        # filter saved at last checkpoint is used if it covers whole seen table,
+        # otherwise it is rebuilt from it
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'bloom_count'").fetchone()
+        seen_count = self.seen
+        bloom = BloomFilter(capacity, error_rate)
+        if seen_count == 0:
+            return bloom
+        if row is not None and row[0] == seen_count and os.path.isfile(self.bloom_path):
+            bits = np.load(self.bloom_path)
+            if bits.shape == bloom.bits.shape:
+                bloom.bits = bits
+                return bloom
+
+        print(f'rebuilding seen filter of {seen_count} routes...')
+        for (route,) in self.db.execute('SELECT route FROM seen'):
+            bloom.add(route)
+        return bloom
+
+    def _is_seen(self, route: str) -> bool:
+        if route not in self.bloom:
+            return False
+        return self.db.execute('SELECT 1 FROM seen WHERE route = ?', (route,)).fetchone() is not None
+
+    def add(self, routes: Iterable[str]) -> int:
+        # queues routes that were never queued before, returns their number
+        added = 0
+        for route in routes:
+            if self._is_seen(route):
+                continue
+            self._insert_seen(route)
+            self.db.execute('INSERT INTO frontier (route, state) VALUES (?, ?)', (route, QUEUED))
+            added += 1
+        self._changed(added)
+        return added
+
+    def pop(self, n: int) -> List[str]:
+        # leases up to n oldest queued routes, each has to be marked done or released
+        rows = self.db.execute('SELECT id, route FROM frontier WHERE state = ? ORDER BY id LIMIT ?',
+                               (QUEUED, n)).fetchall()
+        self.db.executemany('UPDATE frontier SET state = ? WHERE id = ?',
+                            [(LEASED, row_id) for row_id, _ in rows])
+        self._changed(len(rows))
+        return [route for _, route in rows]
+
+    def done(self, route: str) -> None:
+        self.db.execute('DELETE FROM frontier WHERE route = ? AND state = ?', (route, LEASED))
+        self._changed(1)
+
+    def release(self, routes: Iterable[str]) -> None:
+        # leased routes go back to queue
+        self.db.executemany('UPDATE frontier SET state = ? WHERE route = ? AND state = ?',
+                            [(QUEUED, route, LEASED) for route in routes])
+        self._changed(1)
+
+    def __len__(self) -> int:
+        # number of queued routes
+        return self.db.execute('SELECT COUNT(*) FROM frontier WHERE state = ?', (QUEUED,)).fetchone()[0]
+
+    def seen_count(self) -> int:
+        return self.seen
+
+    def _changed(self, count: int) -> None:
+        self.changes += count
+        if (self.changes >= self.checkpoint_every or
+                time.time() - self.last_checkpoint >= self.checkpoint_interval):
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        # commits changes and saves filter, so both describe same seen table
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('bloom_count', ?)",
+                        (self.seen,))
+        tmp_path = f'{self.path}.bloom.tmp.npy'
+        np.save(tmp_path, self.bloom.bits)
+        os.replace(tmp_path, self.bloom_path)
+        self.db.commit()
+        self.changes = 0
+        self.last_checkpoint = time.time()
+
+    def close(self) -> None:
+        self.checkpoint()
+        self.db.close()
+
+    def migrate(self, already_seen: Set[str], queue: deque) -> None:
+        # imports state pickled by crawler.py, routes seen but not queued
+        # anymore were already crawled
+        queued = set(queue)
+        self.add(route for route in queue)
+        for route in already_seen:
+            if route not in queued and not self._is_seen(route):
+                self._insert_seen(route)
+        self.checkpoint()
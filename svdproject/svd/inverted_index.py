@@ -0,0 +1,114 @@
+from typing import List, Tuple
+import numpy as np
+import scipy.sparse as sparse
+from .ranking import top_n, count_matches
+
+
+def doc_positions(postings: "sparse.csr_matrix", docs: "np.array") -> List["np.array"]:
+    # positions[j][t] is index into postings.indices of first document >= docs[j]
+    # in posting list of term t, postings have to be csr with sorted indices
+    n_terms, n_docs = postings.shape
+    # keys grow along whole indices array: lists are in term order, sorted inside
+    starts = np.arange(n_terms, dtype=np.int64) * (n_docs + 1)
+    keys = np.repeat(starts, np.diff(postings.indptr)) + postings.indices
+    return [np.searchsorted(keys, starts + doc) for doc in docs]
+
+
+class InvertedIndex:
+    # posting lists of (M, N) term-by-document matrix, scores only documents
+    # that contain query terms instead of whole corpus
+    def __init__(self, matrix: "sparse.csc_matrix", prune: bool = True,
+                 doc_range: Tuple[int, int] = None, list_bounds: Tuple["np.array", "np.array"] = None) -> None:
+        # doc_range (first, end) restricts index to those documents without copying
+        # postings: posting list of term t is indices[starts[t]:ends[t]] of csr
+        # postings, list_bounds (starts, ends) are computed if not given and
+        # found documents keep their indices in matrix
+        postings = sparse.csr_matrix(matrix)
+        postings.sort_indices()
+
+        first, end = (0, postings.shape[1]) if doc_range is None else doc_range
+        if list_bounds is None:
+            list_bounds = ((postings.indptr[:-1], postings.indptr[1:]) if doc_range is None
+                           else doc_positions(postings, (first, end)))
+
+        self.first_doc = first
+        self.n_docs = end - first
+        self.starts, self.ends = list_bounds
+        self.doc_idxs = postings.indices
+        self.weights = postings.data
+        # if True term lists that can't change top n are only used to
+        # update documents already scored (MaxScore)
+        self.prune = prune
+
+        self.max_weights = np.zeros(postings.shape[0])
+        non_empty = self.ends > self.starts
+        if non_empty.any():
+            # maximum of [start, end) at even positions, odd ones reduce gaps between lists
+            idxs = np.stack((self.starts[non_empty], self.ends[non_empty]), axis=1).ravel()
+            if idxs[-1] == len(self.weights):
+                idxs = idxs[:-1]
+            self.max_weights[non_empty] = np.maximum.reduceat(self.weights, idxs)[::2]
+
+    def _posting_list(self, term_idx: int) -> Tuple["np.array", "np.array"]:
+        start, end = self.starts[term_idx], self.ends[term_idx]
+        return self.doc_idxs[start:end], self.weights[start:end]
+
+    def search(self, term_idxs: "np.array", term_weights: "np.array", n: int,
+               zero_tolerance: float) -> Tuple["np.array", "np.array", int]:
+        # returns n best documents ordered like ranking.top_n on full
+        # similarities vector, their similarities and count of matches
+        bounds = term_weights * self.max_weights[term_idxs]
+        order = np.argsort(-bounds, kind='stable')
+        term_idxs, term_weights, bounds = term_idxs[order], term_weights[order], bounds[order]
+        # remaining[i] is upper bound of score that terms from i onwards can add
+        remaining = np.append(np.cumsum(bounds[::-1])[::-1], 0)
+
+        candidates = np.empty(0, dtype=self.doc_idxs.dtype)
+        scores = np.empty(0)
+
+        i = 0
+        while i < len(term_idxs):
+            docs, weights = self._posting_list(term_idxs[i])
+            candidates, inverse = np.unique(
+                np.concatenate((candidates, docs)), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(
+                (scores, term_weights[i] * weights)), minlength=len(candidates))
+            i += 1
+
+            if self.prune and len(candidates) >= n > 0:
+                threshold = np.partition(scores, len(scores) - n)[len(scores) - n]
+                # documents not scored yet can't reach top n
+                if remaining[i] < threshold:
+                    break
+
+        # documents of pruned lists can't reach top n, they are only
+        # scored for count of matches
+        others, other_scores = [], []
+        for j in range(i, len(term_idxs)):
+            docs, weights = self._posting_list(term_idxs[j])
+            pos = np.searchsorted(candidates, docs)
+            pos[pos == len(candidates)] = 0
+            found = candidates[pos] == docs
+            scores[pos[found]] += term_weights[j] * weights[found]
+            others.append(docs[~found])
+            other_scores.append(term_weights[j] * weights[~found])
+
+        matches = count_matches(scores, zero_tolerance)
+        if len(others) > 0:
+            others, inverse = np.unique(np.concatenate(others), return_inverse=True)
+            matches += count_matches(np.bincount(inverse, weights=np.concatenate(other_scores),
+                                                 minlength=len(others)), zero_tolerance)
+
+        best = top_n(scores, n)
+        doc_idxs = candidates[best]
+        similarities = scores[best]
+
+        missing = min(n, self.n_docs) - len(doc_idxs)
+        if missing > 0:
+            # documents with zero similarity, ordered by index
+            zeros = np.setdiff1d(np.arange(self.first_doc, self.first_doc + min(n, self.n_docs)),
+                                 candidates)[:missing]
+            doc_idxs = np.concatenate((doc_idxs, zeros))
+            similarities = np.concatenate((similarities, np.zeros(len(zeros))))
+
+        return doc_idxs, similarities, matches
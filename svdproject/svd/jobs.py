@@ -0,0 +1,76 @@
+from typing import Any, Callable, Dict, Optional
+import queue
+import threading
+import time
+
+
+class JobState:
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+class SVDJobManager:
+    # builds SVD models of requested orders one at a time on background thread
+    # build(k, progress) returns model, progress(fraction, stage) reports how far it got,
+    # publish(model) makes finished model visible to queries
+    def __init__(self, build: Callable[[int, Callable[[float, str], None]], Any],
+                 publish: Callable[[Any], None]) -> None:
+        self.build = build
+        self.publish = publish
+        self.queue = queue.Queue()
+        self.mutex = threading.Lock()
+        self.jobs: Dict[int, Dict[str, Any]] = {}
+        self.worker = threading.Thread(target=self._work, daemon=True)
+        self.worker.start()
+
+    def submit(self, k: int) -> Dict[str, Any]:
+        # returns status of job for order k, if one is queued or running already
+        # it is not submitted again
+        with self.mutex:
+            job = self.jobs.get(k)
+            if job is not None and job['state'] in (JobState.QUEUED, JobState.RUNNING):
+                return dict(job)
+
+            job = {
+                'order': k,
+                'state': JobState.QUEUED,
+                'progress': 0.0,
+                'stage': None,
+                'error': None,
+                'submitted': time.time()
+            }
+            self.jobs[k] = job
+            self.queue.put(k)
+            return dict(job)
+
+    def status(self, k: Optional[int] = None) -> Any:
+        # returns status of job for order k or list of all jobs if k is None
+        # raises KeyError if no job for order k was submitted
+        with self.mutex:
+            if k is None:
+                return [dict(job) for job in self.jobs.values()]
+            return dict(self.jobs[k])
+
+    def _update(self, k: int, **changes: Any) -> None:
+        with self.mutex:
+            self.jobs[k].update(changes)
+
+    def _work(self) -> None:
+        while True:
+            k = self.queue.get()
+            self._update(k, state=JobState.RUNNING)
+
+            def progress(fraction: float, stage: str) -> None:
+                self._update(k, progress=fraction, stage=stage)
+
+            try:
+                model = self.build(k, progress)
+                self.publish(model)
+                self._update(k, state=JobState.DONE, progress=1.0)
+            except Exception as e:
+                print(f'svd job of order {k} failed: {e}')
+                self._update(k, state=JobState.FAILED, error=str(e))
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,110 @@
+from typing import Any, Dict, Iterator, Optional, Tuple
+import pickle
+import numpy as np
+from .array_store import save_arrays, load_arrays, is_array_dir
+
+# Read only term -> term id mapping packed into few arrays instead of dict:
+# terms sorted by their UTF-8 bytes are concatenated into one blob and looked
+# up by binary search over their offsets, narrowed by sorted array of first
+# 8 bytes of each term. Arrays are memory mapped, so every
+# process attached to same files shares one copy in page cache. Document
+# frequency of each term is stored next to its id.
+
+
+PREFIX_LEN = 8
+
+
+def _prefix(term: bytes) -> int:
+    # first bytes of term as big endian number, order of prefixes agrees with order of terms
+    return int.from_bytes(term[:PREFIX_LEN].ljust(PREFIX_LEN, b'\0'), 'big')
+
+
+class CompactLexicon:
+    def __init__(self, blob: "np.array", offsets: "np.array", prefixes: "np.array",
+                 term_ids: "np.array", df: "np.array") -> None:
+        # term at sorted position i is blob[offsets[i]:offsets[i+1]], prefixes[i]
+        # is _prefix of it, its id is term_ids[i] and document frequency df[i]
+        # plain views of memory maps, indexing np.memmap costs more
+        self.blob = np.asarray(blob)
+        self.offsets = np.asarray(offsets)
+        self.prefixes = np.asarray(prefixes)
+        self.term_ids = np.asarray(term_ids)
+        self.df = np.asarray(df)
+        # slicing memoryview doesn't copy rest of blob
+        self.view = memoryview(self.blob) if len(blob) > 0 else memoryview(b'')
+
+    @classmethod
+    def build(cls, indexed_terms: Dict[str, int], df: "np.array") -> "CompactLexicon":
+        # df is indexed by term id
+        encoded = sorted((term.encode('utf-8'), term_id) for term, term_id in indexed_terms.items())
+        blob = np.frombuffer(b''.join(term for term, _ in encoded), dtype=np.uint8)
+        offsets = np.concatenate(([0], np.cumsum([len(term) for term, _ in encoded]))).astype(np.int64)
+        prefixes = np.array([_prefix(term) for term, _ in encoded], dtype=np.uint64)
+        term_ids = np.array([term_id for _, term_id in encoded], dtype=np.int32)
+        return cls(blob, offsets, prefixes, term_ids, np.asarray(df, dtype=np.int32)[term_ids])
+
+    def to_arrays(self) -> Tuple["np.array", ...]:
+        return self.blob, self.offsets, self.prefixes, self.term_ids, self.df
+
+    @classmethod
+    def from_arrays(cls, arrays: Tuple["np.array", ...]) -> "CompactLexicon":
+        return cls(*arrays)
+
+    def _term(self, i: int) -> bytes:
+        return self.view[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def _find(self, term: str) -> int:
+        # sorted position of term, -1 if it isn't there
+        key = term.encode('utf-8')
+        prefix = np.uint64(_prefix(key))
+        # only terms with same prefix are compared, usually few of them
+        lo = int(self.prefixes.searchsorted(prefix, 'left'))
+        hi = int(self.prefixes.searchsorted(prefix, 'right'))
+        end = hi
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < end and self._term(lo) == key else -1
+
+    def get(self, term: str, default: Any = None) -> Optional[int]:
+        i = self._find(term)
+        return int(self.term_ids[i]) if i >= 0 else default
+
+    def __getitem__(self, term: str) -> int:
+        i = self._find(term)
+        if i < 0:
+            raise KeyError(term)
+        return int(self.term_ids[i])
+
+    def __contains__(self, term: str) -> bool:
+        return self._find(term) >= 0
+
+    def __len__(self) -> int:
+        return len(self.term_ids)
+
+    def doc_frequency(self, term: str) -> int:
+        # number of documents containing term, 0 for terms not indexed
+        i = self._find(term)
+        return int(self.df[i]) if i >= 0 else 0
+
+    def items(self) -> Iterator[Tuple[str, int]]:
+        # (term, id) pairs in sorted order of terms
+        for i in range(len(self.term_ids)):
+            yield self._term(i).decode('utf-8'), int(self.term_ids[i])
+
+
+def save_lexicon(path: str, lexicon: CompactLexicon) -> None:
+    save_arrays(path, lexicon.to_arrays())
+
+
+def load_lexicon(path: str) -> Any:
+    # vocabularies saved before compact format was introduced are pickled dicts
+    # with same lookup methods, raises FileNotFoundError if path doesn't exist
+    if is_array_dir(path):
+        return CompactLexicon.from_arrays(load_arrays(path))
+
+    with open(path, 'rb') as f:
+        return pickle.load(f)
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from svd.search_engine import SearchEngine, Mode
+from svd.batch import BatchRunner
+
+
+class Command(BaseCommand):
+    help = 'Runs queries from file (one per line) and writes results as json lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', help='file with one query per line')
+        parser.add_argument('output', help='file for json line results')
+        parser.add_argument('--mode', type=int, default=Mode.SVD_IDF.value,
+                            help='search mode in range [0, 3]')
+        parser.add_argument('--k', type=int, default=20,
+                            help='number of results per query')
+        parser.add_argument('--order', type=int, default=1000,
+                            help='order of low rank approx for SVD modes')
+        parser.add_argument('--batch-size', type=int, default=256)
+        parser.add_argument('--workers', type=int, default=None)
+        parser.add_argument('--no-snippets', action='store_true',
+                            help='write only document indices and correlations')
+
+    def handle(self, *args, **options):
+        try:
+            mode = Mode(options['mode'])
+        except ValueError:
+            raise CommandError(
+                f'Mode has to be in range [0, 3], got {options["mode"]}')
+
+        runner = BatchRunner(SearchEngine(k=options['order']), k=options['k'],
+                             batch_size=options['batch_size'], n_workers=options['workers'],
+                             snippets=not options['no_snippets'])
+        runner.run(options['queries'], options['output'], mode)
@@ -0,0 +1,51 @@
+import json
+import shutil
+import tempfile
+from django.core.management.base import BaseCommand
+from svd.benchmark import run_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks index building and queries on synthetic corpora, writes results as json'
+    # checks import urlconf of the app, which needs built static data and
+    # would load serving engine competing with benchmarked one
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='file for json results')
+        parser.add_argument('--docs', type=int, nargs='+', default=[1000, 10000],
+                            help='corpus sizes to benchmark')
+        parser.add_argument('--order', type=int, default=100,
+                            help='order of low rank approx for SVD modes')
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--vocab-size', type=int, default=None,
+                            help='defaults to size growing with corpus')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--jobs', type=int, default=1,
+                            help='worker processes for preprocessing')
+        parser.add_argument('--solver', default='arpack',
+                            help='svd solver: arpack, lobpcg or randomized')
+        parser.add_argument('--no-approx', action='store_true',
+                            help='skip ann index build and approximate queries')
+        parser.add_argument('--shards', type=int, default=1,
+                            help='document shards scored in parallel by queries')
+        parser.add_argument('--work-dir', default=None,
+                            help='directory for corpora and index, temporary if not given')
+
+    def handle(self, *args, **options):
+        results = []
+        for n_docs in options['docs']:
+            work_dir = options['work_dir'] or tempfile.mkdtemp(prefix='svd_bench_')
+            work_dir = f'{work_dir}/{n_docs}' if options['work_dir'] else work_dir
+            try:
+                results.append(run_benchmark(work_dir, n_docs, options['order'], options['queries'],
+                                             options['vocab_size'], options['seed'], options['jobs'],
+                                             options['solver'], not options['no_approx'],
+                                             options['shards']))
+            finally:
+                if options['work_dir'] is None:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'results saved at {options["output"]}')
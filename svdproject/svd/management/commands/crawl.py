@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from svd.async_crawler import async_crawler, CONCURRENCY, RATE_LIMIT
+from svd.crawler import URL_PREFIX, STARTING_POINT, LIMIT
+
+
+class Command(BaseCommand):
+    help = 'Crawls news pages into raw data directory, resuming from saved crawl frontier'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default=URL_PREFIX,
+                            help='url prefix of crawled site, e.g. of local stand-in server')
+        parser.add_argument('--start', default=STARTING_POINT,
+                            help='route queued if it was not seen yet')
+        parser.add_argument('--limit', type=int, default=LIMIT,
+                            help='number of documents to save')
+        parser.add_argument('--concurrency', type=int, default=CONCURRENCY,
+                            help='max number of requests in flight')
+        parser.add_argument('--rate', type=float, default=RATE_LIMIT,
+                            help='max requests per second to one host, 0 for no limit')
+        parser.add_argument('--parse-workers', type=int, default=None,
+                            help='processes parsing html, defaults to number of cores')
+        parser.add_argument('--stream-tokens', action='store_true',
+                            help='also tokenize saved documents into token shards, ' +
+                            'see ingest_shards command')
+
+    def handle(self, *args, **options):
+        async_crawler(options['start'], url_prefix=options['prefix'], limit=options['limit'],
+                      concurrency=options['concurrency'], rate_limit=options['rate'],
+                      parse_workers=options['parse_workers'], stream_tokens=options['stream_tokens'])
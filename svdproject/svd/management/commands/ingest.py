@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from svd.preprocessor import Preprocessor
+
+
+class Command(BaseCommand):
+    help = 'Adds newly crawled documents to existing index without rebuilding it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=1,
+                            help='worker processes for preprocessing')
+        parser.add_argument('--shards', action='store_true',
+                            help='also ingest documents streamed into token shards')
+        parser.add_argument('--shard-dir', default=None,
+                            help='token shards directory, defaults to token_shards in pickle dir')
+
+    def handle(self, *args, **options):
+        # servers with shared model see new documents once publish_model is run,
+        # others ingest periodically with SVD_INGEST_INTERVAL or load them on restart
+        preproc = Preprocessor()
+        count = preproc.ingest_new_documents(options['jobs'])
+        if options['shards']:
+            count += preproc.ingest_token_shards(options['shard_dir'])
+        print(f'ingested {count} documents')
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from svd.preprocessor import Preprocessor, FT
+
+
+class Command(BaseCommand):
+    help = 'Indexes documents streamed into token shards by crawl --stream-tokens'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None,
+                            help='token shards directory, defaults to token_shards in pickle dir')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='build index of documents in shards only, instead of ' +
+                            'adding new ones to existing index')
+
+    def handle(self, *args, **options):
+        preproc = Preprocessor()
+        if not options['rebuild']:
+            count = preproc.ingest_token_shards(options['dir'])
+            print(f'ingested {count} documents')
+            return
+
+        preproc.build_tbd_matrix_from_shards(options['dir'])
+        preproc.build_tbd_idf_matrix()
+        # SVDs and snippets of previous index don't match its documents anymore
+        for filetype, build in ((FT.tbd_svd_matrix, preproc.build_tbd_svd_matrix),
+                                (FT.tbd_idf_svd_matrix, preproc.build_tbd_idf_svd_matrix)):
+            try:
+                order = len(preproc._get_it(filetype)[1])
+            except FileNotFoundError:
+                continue
+            build(min(order, min(preproc.get_tbd_matrix().shape) - 1))
+        try:
+            preproc.build_snippet_store(preproc.get_snippet_store()[2][0])
+        except FileNotFoundError:
+            pass
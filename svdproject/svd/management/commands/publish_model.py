@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from svd.search_engine import SearchEngine
+from svd.shared_model import publish_model, DEFAULT_ROOT
+
+
+class Command(BaseCommand):
+    help = 'Publishes model for server workers attached to shared model directory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--order', type=int, default=1000,
+                            help='order of low rank approx for SVD modes')
+        parser.add_argument('--dir', default=None,
+                            help='shared model directory, defaults to SVD_SHARED_MODEL_DIR setting')
+        parser.add_argument('--keep', type=int, default=2,
+                            help='number of newest versions left in directory')
+        parser.add_argument('--ann-lists', type=int, default=settings.SVD_ANN_LISTS,
+                            help='lists of ann indices, defaults to square root of number of documents, 0 disables ann')
+        parser.add_argument('--pq-subspaces', type=int, default=settings.SVD_ANN_PQ_SUBSPACES,
+                            help='product quantization subspaces of ann indices, 0 disables pq')
+
+    def handle(self, *args, **options):
+        root = options['dir'] or getattr(
+            settings, 'SVD_SHARED_MODEL_DIR', None) or DEFAULT_ROOT
+        # builds whatever is missing, including snippet store of served length
+        se = SearchEngine(k=options['order'], ann_lists=options['ann_lists'],
+                          ann_pq_subspaces=options['pq_subspaces'])
+        publish_model(se.preproc, options['order'], root, options['keep'],
+                      options['ann_lists'], options['pq_subspaces'])
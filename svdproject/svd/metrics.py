@@ -0,0 +1,206 @@
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Tuple
+import functools
+import threading
+import time
+
+# Counters, gauges and histograms rendered in Prometheus text format.
+# While registry is disabled nothing is recorded and query stopwatches
+# are shared no-op object, so instrumented code pays about one call per stage.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUILD_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0,
+                 300.0, 600.0, 1800.0, 3600.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: str = None) -> str:
+    parts = [f'{name}="{value}"' for name, value in labels]
+    if extra is not None:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if len(parts) > 0 else ''
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        # last count is for values above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: Labels) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            le = f'le="{bound}"'
+            lines.append(f'{name}_bucket{_format_labels(labels, le)} {cumulative}')
+        le = 'le="+Inf"'
+        lines.append(f'{name}_bucket{_format_labels(labels, le)} {self.count}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {self.sum}')
+        lines.append(f'{name}_count{_format_labels(labels)} {self.count}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.mutex = threading.Lock()
+        # name -> (type, help, buckets)
+        self.meta: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {}
+        # name -> labels -> value or histogram
+        self.values: Dict[str, Dict[Labels, Any]] = {}
+
+    def _register(self, name: str, kind: str, help: str, buckets: Tuple[float, ...] = None) -> None:
+        with self.mutex:
+            self.meta.setdefault(name, (kind, help, buckets))
+            self.values.setdefault(name, {})
+
+    def counter(self, name: str, help: str) -> None:
+        self._register(name, 'counter', help)
+
+    def gauge(self, name: str, help: str) -> None:
+        self._register(name, 'gauge', help)
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self._register(name, 'histogram', help, buckets)
+
+    def inc(self, name: str, amount: float = 1, **labels: Any) -> None:
+        if not self.enabled:
+            return
+        key = _labels(labels)
+        with self.mutex:
+            values = self.values[name]
+            values[key] = values.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels: Any) -> None:
+        if not self.enabled:
+            return
+        with self.mutex:
+            self.values[name][_labels(labels)] = value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        self.observe_stages(name, {None: value}, **labels)
+
+    def observe_stages(self, name: str, stages: Dict[str, float], **labels: Any) -> None:
+        # observes value of each stage with stage label, None stage gets no label
+        if not self.enabled:
+            return
+        base = _labels(labels)
+        with self.mutex:
+            values = self.values[name]
+            for stage, value in stages.items():
+                key = base if stage is None else _labels({**labels, 'stage': stage})
+                histogram = values.get(key)
+                if histogram is None:
+                    histogram = values[key] = _Histogram(self.meta[name][2])
+                histogram.observe(value)
+
+    def stopwatch(self, force: bool = False) -> "Stopwatch":
+        # force records laps even while registry is disabled (for per request breakdowns)
+        return Stopwatch() if self.enabled or force else NULL_STOPWATCH
+
+    def clear(self) -> None:
+        with self.mutex:
+            for values in self.values.values():
+                values.clear()
+
+    def render(self) -> str:
+        # Prometheus text exposition format
+        lines = []
+        with self.mutex:
+            for name, (kind, help, _) in self.meta.items():
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in self.values[name].items():
+                    if kind == 'histogram':
+                        lines.extend(value.render(name, labels))
+                    else:
+                        lines.append(f'{name}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class Stopwatch:
+    # laps are named times between consecutive calls of lap
+    def __init__(self) -> None:
+        self.laps: Dict[str, float] = {}
+        self.last = time.perf_counter()
+
+    def lap(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.laps[stage] = self.laps.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def observe(self, registry: MetricsRegistry, name: str, **labels: Any) -> None:
+        registry.observe_stages(name, self.laps, **labels)
+
+    def milliseconds(self) -> Dict[str, float]:
+        return {stage: round(seconds * 1000, 3) for stage, seconds in self.laps.items()}
+
+
+class _NullStopwatch:
+    laps: Dict[str, float] = {}
+
+    def lap(self, stage: str) -> None:
+        pass
+
+    def observe(self, registry: MetricsRegistry, name: str, **labels: Any) -> None:
+        pass
+
+    def milliseconds(self) -> Dict[str, float]:
+        return {}
+
+
+NULL_STOPWATCH = _NullStopwatch()
+
+REGISTRY = MetricsRegistry()
+REGISTRY.histogram('searchvd_query_stage_seconds',
+                   'Time spent in each stage of query')
+REGISTRY.histogram('searchvd_query_seconds', 'Total time of query')
+REGISTRY.counter('searchvd_queries_total', 'Number of queries')
+REGISTRY.counter('searchvd_query_errors_total',
+                 'Number of queries that failed')
+REGISTRY.histogram('searchvd_build_stage_seconds',
+                   'Time spent in each stage of index building', BUILD_BUCKETS)
+REGISTRY.counter('searchvd_build_stage_failures_total',
+                 'Number of failed index building stages')
+REGISTRY.gauge('searchvd_svd_order', 'Order of low rank approx used by queries')
+REGISTRY.gauge('searchvd_mode_available', 'Whether mode can be queried')
+REGISTRY.gauge('searchvd_ranking_cache_entries',
+               'Number of rankings in cache')
+REGISTRY.gauge('searchvd_ranking_cache_bytes', 'Size of rankings in cache')
+REGISTRY.counter('searchvd_ranking_cache_hits_total', 'Ranking cache hits')
+REGISTRY.counter('searchvd_ranking_cache_misses_total',
+                 'Ranking cache misses')
+
+
+def timed_stage(stage: str) -> Callable:
+    # decorator recording duration of build pipeline stage in REGISTRY
+    def decorator(f: Callable) -> Callable:
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not REGISTRY.enabled:
+                return f(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            except Exception:
+                REGISTRY.inc('searchvd_build_stage_failures_total', stage=stage)
+                raise
+            finally:
+                REGISTRY.observe('searchvd_build_stage_seconds',
+                                 time.perf_counter() - start, stage=stage)
+        return wrapper
+    return decorator
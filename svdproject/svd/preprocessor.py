@@ -2,15 +2,29 @@ import urllib
 from nltk.stem.porter import PorterStemmer
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
-from typing import List, Any, Tuple, Generator, Dict
+from typing import List, Any, Tuple, Generator, Dict, Iterable, Callable
 import pickle
 import os
+import fcntl
+import multiprocessing
+from array import array
+from contextlib import contextmanager
+from functools import lru_cache
 import pathlib
+import shutil
+import time
 import progressbar
 import numpy as np
 import scipy.sparse as sparse
 import scipy.sparse.linalg
 from sklearn.preprocessing import normalize
+from sklearn.utils.extmath import randomized_svd
+from .weighting import apply_weighting, document_frequencies
+from .array_store import save_arrays, load_arrays, is_array_dir
+from .ann import IVFIndex
+from .metrics import timed_stage
+from .token_shards import Shard, ShardWriter, read_shards, read_lexicon, shard_paths
+from .lexicon import CompactLexicon, save_lexicon, load_lexicon
 from enum import Enum
 from django.contrib.staticfiles import finders
 
@@ -20,20 +34,44 @@ class FT(Enum):
     indexed_filenames_dict = 'indexed_filenames_DICT'
     indexed_filenames_list = 'indexed_filenames_LIST'
     preprocessed_data_dir = 'bbc_data_preprocessed'
+    # term -> term id, saved as CompactLexicon
     indexed_terms = 'indexed_terms'
     tbd_matrix = 'tbd_matrix'
     tbd_matrix_not_norm = 'tbd_matrix_not_norm'
     tbd_idf_matrix = 'tbd_idf_matrix'
-    # filenames will have appended _k where k is order of low rank approx
+    # stored as (U, s, VT) of highest order computed so far, lower orders are sliced from it
     tbd_svd_matrix = 'tbd_svd_matrix'
     tbd_idf_svd_matrix = 'tbd_idf_svd_matrix'
+    snippet_store = 'snippet_store'
+    # weighting schemes and SVD bookkeeping needed by incremental ingest
+    index_state = 'index_state'
+    # tokenized documents streamed by crawler (see token_shards)
+    token_shards = 'token_shards'
+
+
+# stored as memory mapped arrays (see array_store), other files are pickled
+ARRAY_FILES = {FT.tbd_matrix, FT.tbd_matrix_not_norm, FT.tbd_idf_matrix,
+               FT.tbd_svd_matrix, FT.tbd_idf_svd_matrix, FT.snippet_store}
+# held by ingest in pickle dir
+INGEST_LOCK_FN = '.ingest_lock'
 
 
 class Preprocessor:
     RAW_DATA_DIR = finders.find('svd/bbc_data')
     PICKLE_DIR = finders.find('svd/.pickled')
 
-    def __init__(self, stemmer: Any = None, stop_words: List[str] = None) -> None:
+    def __init__(self, stemmer: Any = None, stop_words: List[str] = None,
+                 svd_max_order: int = 1000, svd_solver: str = 'arpack',
+                 query_memo_size: int = 100_000, tokenizer: Callable[[str], List[str]] = None,
+                 raw_data_dir: str = None, pickle_dir: str = None) -> None:
+        # tokenizer defaults to nltk word_tokenize, directories to ones found in static files
+        if raw_data_dir is not None:
+            self.RAW_DATA_DIR = raw_data_dir
+        if pickle_dir is not None:
+            self.PICKLE_DIR = pickle_dir
+        self.tokenizer = tokenizer
+        self.query_memo_size = query_memo_size
+
         self.paths = {filetype: pathlib.Path(
             self.PICKLE_DIR, filetype.value) for filetype in FT}
 
@@ -48,18 +86,56 @@ class Preprocessor:
             'english') if stop_words is None else stop_words
         self.stop_words = set(self.stop_words)
 
+        # SVD is always computed with at least svd_max_order singular values
+        self.svd_max_order = svd_max_order
+        self.svd_solver = svd_solver
+
+        # whitespace separated query chunk -> ids of its indexed terms, so tokenizing
+        # and stemming of repeated words is skipped, cleared when vocabulary changes
+        self._chunk_term_ids = lru_cache(maxsize=query_memo_size)(self._lookup_chunk)
+
+        # order and (U, S) of low rank approx last sliced from stored SVD
         self.svd_orders = {
             FT.tbd_svd_matrix: None,
             FT.tbd_idf_svd_matrix: None
         }
+        self.low_rank = {
+            FT.tbd_svd_matrix: None,
+            FT.tbd_idf_svd_matrix: None
+        }
+
+    def config(self) -> Dict[str, Any]:
+        # arguments for constructing preprocessor with same configuration
+        return {
+            'stemmer': self.stemmer,
+            'stop_words': list(self.stop_words),
+            'svd_max_order': self.svd_max_order,
+            'svd_solver': self.svd_solver,
+            'query_memo_size': self.query_memo_size,
+            'tokenizer': self.tokenizer,
+            'raw_data_dir': self.RAW_DATA_DIR,
+            'pickle_dir': self.PICKLE_DIR
+        }
 
     def _load_it(self, filetype: FT) -> None:
-        self.files[filetype] = load_binary(self.paths[filetype])
+        if filetype == FT.indexed_terms:
+            self.files[filetype] = load_lexicon(self.paths[filetype])
+        elif filetype in ARRAY_FILES:
+            self.files[filetype] = load_matrices(self.paths[filetype])
+        else:
+            self.files[filetype] = load_binary(self.paths[filetype])
 
     def _save_it(self, filetype: FT, data: Any) -> None:
         self.files[filetype] = data
-        save_binary(self.paths[filetype], data)
-
+        if filetype == FT.indexed_terms:
+            self._chunk_term_ids.cache_clear()
+            save_lexicon(self.paths[filetype], data)
+        elif filetype in ARRAY_FILES:
+            save_arrays(self.paths[filetype], data)
+        else:
+            save_binary(self.paths[filetype], data)
+
+    @timed_stage('index_documents')
     def index_documents(self) -> None:
         indexed_filenames_dict = {}
         indexed_filenames_list = []
@@ -76,33 +152,57 @@ class Preprocessor:
             f'saved filename indices at {self.paths[FT.indexed_filenames_dict]}' +
             f'and {self.paths[FT.indexed_filenames_list]}')
 
+    @timed_stage('preprocess_docs')
     def preprocess_docs(self, stem=True, remove_stop_words=True,
-                        only_alnum=True, ignore_case=True) -> None:
+                        only_alnum=True, ignore_case=True, n_jobs: int = 1, chunksize: int = 64) -> None:
+        # n_jobs is number of worker processes, None means all cores
+        # tokens of documents are packed into token shards (see token_shards),
+        # previously preprocessed documents are removed
         print('preprocessing...')
 
         with os.scandir(self.RAW_DATA_DIR) as raw_entires:
-            raw_entires = list(raw_entires)
-            bar = progressbar.ProgressBar(maxval=len(raw_entires))
-            bar.start()
-            for i, entry in enumerate(raw_entires):
-                with open(pathlib.Path(self.RAW_DATA_DIR, entry.name), 'r') as f:
-                    data = f.read()
-                    tokens = self._preprocess_doc(
-                        data, stem, remove_stop_words, only_alnum, ignore_case)
-
-                f_path = pathlib.Path(
-                    self.paths[FT.preprocessed_data_dir], entry.name)
-                save_binary(f_path, tokens)
+            names = [entry.name for entry in raw_entires]
 
-                bar.update(i+1)
-            bar.finish()
+        shutil.rmtree(self.paths[FT.preprocessed_data_dir])
+        os.mkdir(self.paths[FT.preprocessed_data_dir])
+        self._preprocess_files(names, (stem, remove_stop_words, only_alnum, ignore_case),
+                               n_jobs, chunksize)
 
         print(
             f'saved preprocessed documents at {self.paths[FT.preprocessed_data_dir]}/*')
 
+    def _preprocess_files(self, names: List[str], options: Tuple[bool, bool, bool, bool] = (True,) * 4,
+                          n_jobs: int = 1, chunksize: int = 64) -> None:
+        # appends tokens of documents to token shards of preprocessed data dir, in order of names
+        bar = progressbar.ProgressBar(maxval=len(names))
+        bar.start()
+        shards = ShardWriter(str(self.paths[FT.preprocessed_data_dir]))
+
+        if n_jobs == 1:
+            for i, name in enumerate(names):
+                shards.append(name, self._preprocess_file(name, *options))
+                bar.update(i+1)
+        else:
+            with multiprocessing.Pool(n_jobs, initializer=_init_worker,
+                                      initargs=(self.config(),)) as pool:
+                tasks = pool.imap(_preprocess_file_in_worker,
+                                  [(name, options) for name in names], chunksize)
+                for i, (name, tokens) in enumerate(tasks):
+                    shards.append(name, tokens)
+                    bar.update(i+1)
+
+        shards.close()
+        bar.finish()
+
+    def _preprocess_file(self, name: str, stem: bool = True, remove_stop_words: bool = True,
+                         only_alnum: bool = True, ignore_case: bool = True) -> List[str]:
+        with open(pathlib.Path(self.RAW_DATA_DIR, name), 'r') as f:
+            return self._preprocess_doc(
+                f.read(), stem, remove_stop_words, only_alnum, ignore_case)
+
     def _preprocess_doc(self, doc: str, stem: bool = True, remove_stop_words: bool = True,
                         only_alnum: bool = True, ignore_case: bool = True) -> List[str]:
-        tokens = word_tokenize(doc)
+        tokens = word_tokenize(doc) if self.tokenizer is None else self.tokenizer(doc)
 
         # transform to lower case
         if ignore_case:
@@ -122,59 +222,119 @@ class Preprocessor:
 
         return tokens
 
-    def index_terms(self) -> None:
-        indexed_terms = {}
-        count = 0
-        for _, doc in self.get_preprocessed_docs():
-            for token in doc:
-                if token not in indexed_terms:
-                    indexed_terms[token] = count
-                    count += 1
-
-        self._save_it(FT.indexed_terms, indexed_terms)
-
-        print(
-            f'saved indexed terms at {self.paths[FT.indexed_terms]}')
-
-    def _build_tbd(self):
-        indexed_docs, _ = self.get_doc_indices()
-        indexed_terms = self.get_indexed_terms()
-
-        N = len(indexed_docs)
+    def _count_shard_terms(self, shards: Iterable[Shard], lexicon: List[str], indexed_docs: Dict[str, int],
+                           indexed_docs_list: List[str], indexed_terms: Dict[str, int],
+                           first_doc: int = None) -> "sparse.csc_matrix":
+        # returns (M, N - first_doc) matrix of term counts of documents in shards, column
+        # of document is its index minus first_doc, documents with index lower than
+        # first_doc (default N) are skipped, documents not indexed yet are appended to
+        # indexed docs in order of shards and their new terms to indexed_terms
+        first_doc = len(indexed_docs_list) if first_doc is None else first_doc
+        # lexicon id -> term id, -1 for terms not indexed yet
+        lex2term = np.array([indexed_terms.get(term, -1) for term in lexicon], dtype=np.int64)
+        counted = set()
+        rows, cols, counts = [], [], []
+
+        for shard in shards:
+            lengths = np.diff(shard.doc_offsets)
+            doc_cols = np.full(len(shard.names), -1, dtype=np.int64)
+            for i, name in enumerate(shard.names):
+                if name not in indexed_docs:
+                    indexed_docs[name] = len(indexed_docs_list)
+                    indexed_docs_list.append(name)
+                # document preprocessed again is counted once
+                if indexed_docs[name] >= first_doc and name not in counted:
+                    counted.add(name)
+                    doc_cols[i] = indexed_docs[name] - first_doc
+
+            token_cols = np.repeat(doc_cols, lengths)
+            keep = token_cols >= 0
+            token_ids, token_cols = np.asarray(shard.token_ids)[keep], token_cols[keep]
+            if len(token_ids) == 0:
+                continue
+
+            # new terms are indexed in order of their first occurrence
+            new = lex2term[token_ids] < 0
+            if new.any():
+                new_ids, first = np.unique(token_ids[new], return_index=True)
+                for lex_id in new_ids[np.argsort(first)]:
+                    lex2term[lex_id] = indexed_terms[lexicon[lex_id]] = len(indexed_terms)
+
+            # duplicates are summed up, only nonzero counts of shard are kept
+            shard_counts = sparse.coo_matrix(
+                (np.ones(len(token_ids)), (lex2term[token_ids], token_cols)),
+                shape=(len(indexed_terms), len(indexed_docs_list) - first_doc)).tocsc().tocoo()
+            rows.append(shard_counts.row)
+            cols.append(shard_counts.col)
+            counts.append(shard_counts.data)
+
+        N = len(indexed_docs_list) - first_doc
         M = len(indexed_terms)
+        if len(rows) == 0:
+            return sparse.csc_matrix((M, N))
 
-        tbd_matrix = sparse.lil_matrix((M, N))
+        return sparse.csc_matrix((np.concatenate(counts), (np.concatenate(rows), np.concatenate(cols))),
+                                 shape=(M, N))
 
-        for name, doc in self.get_preprocessed_docs():
-            doc_idx = indexed_docs[name]
-            for term in doc:
-                term_idx = indexed_terms[term]
-                tbd_matrix[term_idx, doc_idx] += 1
+    def _build_tbd(self) -> Tuple["sparse.csc_matrix", Dict[str, int]]:
+        # indexes terms and counts them in single pass over token shards of preprocessed docs
+        # raises FileNotFoundError if docs weren't preprocessed
+        shard_dir = str(self.paths[FT.preprocessed_data_dir])
+        if len(shard_paths(shard_dir)) == 0:
+            raise FileNotFoundError(f'no preprocessed documents found within {shard_dir}')
 
-        return tbd_matrix
+        indexed_docs, indexed_docs_list = self.get_doc_indices()
+        indexed_terms = {}
+        tbd_matrix = self._count_shard_terms(read_shards(shard_dir), read_lexicon(shard_dir),
+                                             dict(indexed_docs), list(indexed_docs_list),
+                                             indexed_terms, first_doc=0)
+        if tbd_matrix.shape[1] != len(indexed_docs_list):
+            raise ValueError('preprocessed documents differ from indexed ones, preprocess them again')
+
+        return tbd_matrix, indexed_terms
 
+    @timed_stage('build_tbd_matrix')
     def build_tbd_matrix(self) -> None:
-        tbd_matrix = self._build_tbd()
+        self._save_tbd(*self._build_tbd())
+
+    @timed_stage('build_tbd_matrix_from_shards')
+    def build_tbd_matrix_from_shards(self, shard_dir: str = None) -> None:
+        # indexes documents of token shards (e.g. streamed by crawler) instead of
+        # preprocessed documents, shard_dir defaults to token_shards in pickle dir
+        shard_dir = str(self.paths[FT.token_shards]) if shard_dir is None else shard_dir
+        paths = shard_paths(shard_dir)
+        if len(paths) == 0:
+            raise FileNotFoundError(f'no token shards found within {shard_dir}')
+
+        indexed_docs_dict, indexed_docs_list, indexed_terms = {}, [], {}
+        tbd_matrix = self._count_shard_terms(read_shards(shard_dir), read_lexicon(shard_dir),
+                                             indexed_docs_dict, indexed_docs_list, indexed_terms)
+        self._save_it(FT.indexed_filenames_dict, indexed_docs_dict)
+        self._save_it(FT.indexed_filenames_list, indexed_docs_list)
+        self._save_tbd(tbd_matrix, indexed_terms)
+        self._update_index_state(token_shards_consumed=len(paths))
+
+    def _save_tbd(self, tbd_matrix: "sparse.csc_matrix", indexed_terms: Dict[str, int]) -> None:
+        self._save_it(FT.indexed_terms, CompactLexicon.build(
+            indexed_terms, document_frequencies(tbd_matrix)))
+        print(
+            f'saved indexed terms at {self.paths[FT.indexed_terms]}')
+
         self._save_it(FT.tbd_matrix_not_norm, tbd_matrix)
 
-        tbd_matrix = normalize(tbd_matrix, axis=0, copy=False)
-        tbd_matrix = tbd_matrix.tocsc(copy=False)
+        # not normalized matrix is kept in memory, so it can't be modified
+        tbd_matrix = normalize(tbd_matrix, axis=0)
 
         self._save_it(FT.tbd_matrix, tbd_matrix)
         print(
             f'saved term-by-document matrix at {self.paths[FT.tbd_matrix]}')
 
-    def build_tbd_idf_matrix(self) -> None:
-        tbd_idf_matrix = self._get_it(FT.tbd_matrix_not_norm)
-
-        tbd_idf_matrix = tbd_idf_matrix.tocsr(copy=False)
-        N = tbd_idf_matrix.shape[1]
-
-        n_w_vec = scipy.sparse.linalg.norm(tbd_idf_matrix, ord=0, axis=1)
-        idf_vec = np.log(N / n_w_vec)
-
-        for i, idf in enumerate(idf_vec):
-            tbd_idf_matrix[i, :] *= idf
+    @timed_stage('build_tbd_idf_matrix')
+    def build_tbd_idf_matrix(self, tf: str = 'raw', idf: str = 'standard') -> None:
+        # tf and idf are names of schemes from weighting.TF_SCHEMES and weighting.IDF_SCHEMES
+        tbd_idf_matrix = apply_weighting(
+            self._get_it(FT.tbd_matrix_not_norm), tf, idf)
+        self._update_index_state(tf=tf, idf=idf)
 
         tbd_idf_matrix = normalize(tbd_idf_matrix, axis=0, copy=False)
 
@@ -185,53 +345,67 @@ class Preprocessor:
         print(
             f'saved term-by-document IDF matrix at {self.paths[FT.tbd_idf_matrix]}')
 
-    def _build_svd(self, matrix, k, zero_tolerance=1e-13):
-        U, S, VT = scipy.sparse.linalg.svds(matrix, k=k)
-        D = np.diag(S)
-        S = D @ VT
-
-        S[abs(S) < zero_tolerance] = 0
-        S = sparse.csc_matrix(S)
-        S = normalize(S, axis=0, copy=False)
-
-        return U, S
-
-    def build_tbd_svd_matrix(self, k: int) -> None:
-        tbd_svd_matrix = self._build_svd(
-            self.get_tbd_matrix(), k)  # stored as tuple U, S
-
-        # save it with _k as suffix
-        k_path = f'{self.paths[FT.tbd_svd_matrix]}_{k}'
-
-        save_binary(k_path, tbd_svd_matrix)
-        self.files[FT.tbd_svd_matrix] = tbd_svd_matrix
-
-        print(f'saved svd {k} low rank approx of tbd matrix at {k_path}')
-
-    def build_tbd_idf_svd_matrix(self, k: int) -> None:
-        tbd_idf_svd_matrix = self._build_svd(self.get_tbd_idf_matrix(), k)
-
-        # save it with _k as suffix
-        k_path = f'{self.paths[FT.tbd_idf_svd_matrix]}_{k}'
-
-        save_binary(k_path, tbd_idf_svd_matrix)
-        self.files[FT.tbd_idf_svd_matrix] = tbd_idf_svd_matrix
-
-        print(f'saved svd {k} low rank approx of tbd idf matrix at {k_path}')
+    def _build_svd(self, matrix: "sparse.csc_matrix", k: int,
+                   solver: str = 'arpack') -> Tuple["np.array", "np.array", "np.array"]:
+        # returns U, s, VT with singular values in descending order
+        if solver == 'randomized':
+            U, s, VT = randomized_svd(matrix, k, random_state=0)
+        else:
+            U, s, VT = scipy.sparse.linalg.svds(matrix, k=k, solver=solver)
+
+        order = np.argsort(s)[::-1]
+        return U[:, order], s[order], VT[order]
+
+    def _build_svd_of(self, filetype: FT, matrix: "sparse.csc_matrix", k: int, solver: str = None) -> None:
+        # any order up to computed one can be sliced later without another decomposition
+        # raises ValueError if k is not positive or not smaller than both dimensions of matrix
+        check_order(k)
+        solver = self.svd_solver if solver is None else solver
+        order = min(max(k, self.svd_max_order), min(matrix.shape) - 1)
+        if order < k:
+            raise ValueError(
+                f'order {k} too high for matrix of shape {matrix.shape}')
+
+        start = time.time()
+        U, s, VT = self._build_svd(matrix, order, solver)
+        # single precision is enough for scoring and halves memory
+        factors = (U.astype(np.float32), s, VT.astype(np.float32))
+        print(f'computed svd of order {order} using {solver} in {np.around(time.time() - start, 2)}s')
+
+        self._save_it(filetype, factors)
+        self.svd_orders[filetype] = None
+        self._set_svd_base_docs(filetype, matrix.shape[1])
+        self._remove_ann_indices(filetype)
+
+        print(f'saved svd of order {order} at {self.paths[filetype]}')
+
+    @timed_stage('build_tbd_svd_matrix')
+    def build_tbd_svd_matrix(self, k: int, solver: str = None) -> None:
+        # solver is one of: arpack, lobpcg, propack, randomized
+        self._build_svd_of(FT.tbd_svd_matrix, self.get_tbd_matrix(), k, solver)
+
+    @timed_stage('build_tbd_idf_svd_matrix')
+    def build_tbd_idf_svd_matrix(self, k: int, solver: str = None) -> None:
+        self._build_svd_of(FT.tbd_idf_svd_matrix,
+                           self.get_tbd_idf_matrix(), k, solver)
 
     def get_preprocessed_docs(self) -> Generator[Tuple[str, List[str]], None, None]:
         # throws FileNotFound if it wasn't preprocessed before
         # returns filename (urlencoded) with its preprocessed tokens
-        has_files = False
-        with os.scandir(self.paths[FT.preprocessed_data_dir]) as entries:
-            for entry in entries:
-                has_files = True
-                with open(pathlib.Path(self.paths[FT.preprocessed_data_dir], entry.name), 'rb') as f:
-                    yield entry.name, pickle.load(f)
-
-        if not has_files:
-            raise FileNotFoundError(
-                f'no files found within {self.paths[FT.preprocessed_data_dir]}')
+        shard_dir = str(self.paths[FT.preprocessed_data_dir])
+        if len(shard_paths(shard_dir)) == 0:
+            raise FileNotFoundError(f'no preprocessed documents found within {shard_dir}')
+
+        lexicon = read_lexicon(shard_dir)
+        for shard in read_shards(shard_dir):
+            for name, start, end in zip(shard.names, shard.doc_offsets[:-1], shard.doc_offsets[1:]):
+                yield name, [lexicon[term_id] for term_id in shard.token_ids[start:end]]
+
+    def attach_files(self, files: Dict[FT, Any]) -> None:
+        # serves given data instead of loading it from pickle dir, nothing is saved
+        self.files.update(files)
+        if FT.indexed_terms in files:
+            self._chunk_term_ids.cache_clear()
 
     def _get_it(self, file_type: FT) -> Any:
         if self.files[file_type] is not None:
@@ -243,7 +417,8 @@ class Preprocessor:
     def get_doc_indices(self) -> Tuple[Dict[str, int], List[str]]:
         return self._get_it(FT.indexed_filenames_dict), self._get_it(FT.indexed_filenames_list)
 
-    def get_indexed_terms(self) -> Dict[str, int]:
+    def get_indexed_terms(self) -> CompactLexicon:
+        # dict for vocabularies saved before CompactLexicon, both map term to its id
         return self._get_it(FT.indexed_terms)
 
     def get_tbd_matrix(self) -> "np.array":
@@ -255,91 +430,426 @@ class Preprocessor:
         return self._get_it(FT.tbd_idf_matrix)
 
     def _get_svd(self, filetype: FT, k: int):
-        if self.files[filetype] is not None and self.svd_orders[filetype] == k:
-            return self.files[filetype]
-
-        self.svd_orders[filetype] = k
-        path = f'{self.paths[filetype]}_{k}'
+        # raises ValueError if k is not positive
+        check_order(k)
+        if self.low_rank[filetype] is not None and self.svd_orders[filetype] == k:
+            return self.low_rank[filetype]
 
         try:
-            self.files[filetype] = load_binary(path)
-            return self.files[filetype]
+            U, s, VT = self._get_it(filetype)
         except FileNotFoundError:
-            available = []
-            with os.scandir(self.PICKLE_DIR) as pd:
-                for entry in pd:
-                    if entry.name.startswith(filetype.value):
-                        available.append(entry.name)
+            raise FileNotFoundError(f'svd of {filetype.value} not found')
 
-            msg = f'{k} low rank approx not found'
-            msg += f' available: {available}' if len(available) > 0 else ''
-            raise FileNotFoundError(msg)
+        if k > len(s):
+            raise FileNotFoundError(
+                f'{k} low rank approx not found, available up to {len(s)}')
+
+        self.low_rank[filetype] = low_rank_approx(U, s, VT, k)
+        self.svd_orders[filetype] = k
+        return self.low_rank[filetype]
+
+    def clear_svd_cache(self) -> None:
+        # SVDs (and index state) saved by another preprocessor are loaded on next use
+        for filetype in (FT.tbd_svd_matrix, FT.tbd_idf_svd_matrix):
+            self.files[filetype] = None
+            self.svd_orders[filetype] = None
+            self.low_rank[filetype] = None
+        self.files[FT.index_state] = None
+
+    def _ann_path(self, filetype: FT, k: int) -> str:
+        return f'{self.paths[filetype]}_ann_{k}'
+
+    def _remove_ann_indices(self, filetype: FT) -> None:
+        # indices are built from document vectors of specific SVD
+        with os.scandir(self.PICKLE_DIR) as pd:
+            for entry in pd:
+                if entry.name.startswith(f'{filetype.value}_ann_'):
+                    shutil.rmtree(entry.path)
+
+    @timed_stage('build_ann_index')
+    def _build_ann_index(self, filetype: FT, k: int, n_lists: int = None,
+                         pq_subspaces: int = 0) -> IVFIndex:
+        _, doc_vectors = self._get_svd(filetype, k)
+
+        start = time.time()
+        index = IVFIndex.build(doc_vectors, n_lists, pq_subspaces)
+        print(f'built ann index with {index.n_lists} lists in {np.around(time.time() - start, 2)}s')
+
+        path = self._ann_path(filetype, k)
+        save_arrays(path, index.to_arrays())
+        print(f'saved ann index of svd {k} low rank approx at {path}')
+
+        return index
+
+    def _get_ann_index(self, filetype: FT, k: int, n_lists: int = None, pq_subspaces: int = 0) -> IVFIndex:
+        # raises FileNotFoundError if index wasn't built for order k with same arguments
+        index = IVFIndex.from_arrays(load_arrays(self._ann_path(filetype, k)))
+        _, doc_vectors = self._get_svd(filetype, k)
+        if not index.built_with(doc_vectors.shape[0], n_lists, pq_subspaces):
+            raise FileNotFoundError(f'ann index of order {k} was built with other arguments')
+        return index
+
+    def build_tbd_svd_ann_index(self, k: int, n_lists: int = None, pq_subspaces: int = 0) -> IVFIndex:
+        # n_lists defaults to square root of number of documents, 0 pq_subspaces disables PQ
+        return self._build_ann_index(FT.tbd_svd_matrix, k, n_lists, pq_subspaces)
+
+    def build_tbd_idf_svd_ann_index(self, k: int, n_lists: int = None, pq_subspaces: int = 0) -> IVFIndex:
+        return self._build_ann_index(FT.tbd_idf_svd_matrix, k, n_lists, pq_subspaces)
+
+    def get_tbd_svd_ann_index(self, k: int, n_lists: int = None, pq_subspaces: int = 0) -> IVFIndex:
+        # memory mapped index saved by build with same arguments
+        return self._get_ann_index(FT.tbd_svd_matrix, k, n_lists, pq_subspaces)
+
+    def get_tbd_idf_svd_ann_index(self, k: int, n_lists: int = None, pq_subspaces: int = 0) -> IVFIndex:
+        return self._get_ann_index(FT.tbd_idf_svd_matrix, k, n_lists, pq_subspaces)
+
+    def load_ann_indices(self, k: int, n_lists: int = None,
+                         pq_subspaces: int = 0) -> Tuple[IVFIndex, IVFIndex]:
+        # ann indices of tbd and tbd idf svd, built and saved if missing
+        indices = []
+        for filetype in (FT.tbd_svd_matrix, FT.tbd_idf_svd_matrix):
+            try:
+                indices.append(self._get_ann_index(filetype, k, n_lists, pq_subspaces))
+            except FileNotFoundError:
+                print(f'ann index of {filetype.value} with k={k} not found. Building...')
+                indices.append(self._build_ann_index(filetype, k, n_lists, pq_subspaces))
+        return tuple(indices)
 
     def get_tbd_svd_matrix(self, k: int):
-        # returns normalized low rank approx using k singular values of tbd matrix
+        # returns U and normalized document vectors of low rank approx using k singular values of tbd matrix
         return self._get_svd(FT.tbd_svd_matrix, k)
 
     def get_tbd_idf_svd_matrix(self, k: int):
-        # returns normalized low rank approx using k singular values of tbd matrix with IDF already applied
+        # same as get_tbd_svd_matrix for tbd matrix with IDF already applied
         return self._get_svd(FT.tbd_idf_svd_matrix, k)
 
-    def update_all(self) -> None:
+    def _get_index_state(self) -> Dict[str, Any]:
+        try:
+            return self._get_it(FT.index_state)
+        except FileNotFoundError:
+            return {'tf': 'raw', 'idf': 'standard', 'svd_base_docs': {}}
+
+    def _update_index_state(self, **changes: Any) -> None:
+        state = dict(self._get_index_state())
+        state.update(changes)
+        self._save_it(FT.index_state, state)
+
+    def _set_svd_base_docs(self, filetype: FT, n_docs: int) -> None:
+        # number of documents that SVD was computed from, rest of them were folded in
+        base_docs = dict(self._get_index_state()['svd_base_docs'])
+        base_docs[filetype.value] = n_docs
+        self._update_index_state(svd_base_docs=base_docs)
+
+    def _fold_in_svd(self, filetype: FT, docs_matrix: "sparse.csc_matrix") -> None:
+        # projects normalized (M, n) columns of new documents onto existing
+        # singular vectors, new terms get zero rows in U
+        U, s, VT = self._get_it(filetype)
+        U = np.vstack((U, np.zeros((docs_matrix.shape[0] - U.shape[0], U.shape[1]), dtype=U.dtype)))
+
+        new_VT = (U.T @ docs_matrix) / s[:, np.newaxis]
+        VT = np.hstack((VT, new_VT.astype(VT.dtype)))
+
+        self._save_it(filetype, (U, s, VT))
+        self.svd_orders[filetype] = None
+        self._remove_ann_indices(filetype)
+
+    @contextmanager
+    def _ingest_lock(self) -> Generator[None, None, None]:
+        # ingests into same pickle dir (e.g. of server and ingest command) wait for
+        # each other, files saved by other one meanwhile are loaded again
+        with open(os.path.join(self.PICKLE_DIR, INGEST_LOCK_FN), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                self.files = {filetype: None for filetype in FT}
+                self.clear_svd_cache()
+                self._chunk_term_ids.cache_clear()
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @timed_stage('ingest_new_documents')
+    def ingest_new_documents(self, n_jobs: int = 1, svd_recompute_ratio: float = 0.1) -> int:
+        # indexes files from RAW_DATA_DIR that weren't indexed yet, returns their number
+        # new documents are folded into existing SVDs, SVD is recomputed once
+        # more than svd_recompute_ratio of its documents were folded in
+        with self._ingest_lock():
+            return self._ingest_new_documents(n_jobs, svd_recompute_ratio)
+
+    def _ingest_new_documents(self, n_jobs: int, svd_recompute_ratio: float) -> int:
+        indexed_docs_dict, indexed_docs_list = self.get_doc_indices()
+        with os.scandir(self.RAW_DATA_DIR) as raw_entries:
+            new_names = [entry.name for entry in raw_entries
+                         if entry.name not in indexed_docs_dict]
+
+        if len(new_names) == 0:
+            return 0
+
+        print(f'ingesting {len(new_names)} new documents...')
+        shard_dir = str(self.paths[FT.preprocessed_data_dir])
+        first_shard = len(shard_paths(shard_dir))
+        self._preprocess_files(new_names, n_jobs=n_jobs)
+
+        indexed_docs_dict, indexed_docs_list = dict(indexed_docs_dict), list(indexed_docs_list)
+        indexed_terms = dict(self.get_indexed_terms().items())
+        new_counts = self._count_shard_terms(read_shards(shard_dir, first_shard), read_lexicon(shard_dir),
+                                             indexed_docs_dict, indexed_docs_list, indexed_terms)
+
+        self._extend_index(indexed_docs_dict, indexed_docs_list, indexed_terms,
+                           new_counts, svd_recompute_ratio)
+        return len(new_names)
+
+    @timed_stage('ingest_token_shards')
+    def ingest_token_shards(self, shard_dir: str = None, svd_recompute_ratio: float = 0.1) -> int:
+        # same as ingest_new_documents for documents of token shards written since
+        # last build or ingest of shards, documents already indexed are skipped
+        with self._ingest_lock():
+            return self._ingest_token_shards(shard_dir, svd_recompute_ratio)
+
+    def _ingest_token_shards(self, shard_dir: str, svd_recompute_ratio: float) -> int:
+        shard_dir = str(self.paths[FT.token_shards]) if shard_dir is None else shard_dir
+        paths = shard_paths(shard_dir)
+        consumed = self._get_index_state().get('token_shards_consumed', 0)
+        if len(paths) <= consumed:
+            return 0
+
+        indexed_docs_dict, indexed_docs_list = self.get_doc_indices()
+        indexed_docs_dict, indexed_docs_list = dict(indexed_docs_dict), list(indexed_docs_list)
+        indexed_terms = dict(self.get_indexed_terms().items())
+        N_old = len(indexed_docs_list)
+
+        new_counts = self._count_shard_terms(read_shards(shard_dir, consumed), read_lexicon(shard_dir),
+                                             indexed_docs_dict, indexed_docs_list, indexed_terms)
+        if new_counts.shape[1] > 0:
+            print(f'ingesting {new_counts.shape[1]} new documents from {len(paths) - consumed} shards...')
+            self._extend_index(indexed_docs_dict, indexed_docs_list, indexed_terms,
+                               new_counts, svd_recompute_ratio)
+        self._update_index_state(token_shards_consumed=len(paths))
+        return len(indexed_docs_list) - N_old
+
+    def _extend_index(self, indexed_docs_dict: Dict[str, int], indexed_docs_list: List[str],
+                      indexed_terms: Dict[str, int], new_counts: "sparse.csc_matrix",
+                      svd_recompute_ratio: float) -> None:
+        # saves indices extended with new documents (last columns of new_counts.shape[1])
+        # and appends them to every matrix, snippet store and SVD
+        N = len(indexed_docs_list)
+        N_old = N - new_counts.shape[1]
+        new_names = indexed_docs_list[N_old:]
+        self._save_it(FT.indexed_filenames_dict, indexed_docs_dict)
+        self._save_it(FT.indexed_filenames_list, indexed_docs_list)
+        tbd_matrix = extend_columns(self._get_it(FT.tbd_matrix_not_norm), new_counts)
+        self._save_it(FT.indexed_terms, CompactLexicon.build(
+            indexed_terms, document_frequencies(tbd_matrix)))
+        self._save_it(FT.tbd_matrix_not_norm, tbd_matrix)
+        new_tbd = normalize(new_counts, axis=0)
+        self._save_it(FT.tbd_matrix, extend_columns(
+            self.get_tbd_matrix(), new_tbd))
+
+        # document frequencies changed, so did IDF of every document
+        state = self._get_index_state()
+        self.build_tbd_idf_matrix(state['tf'], state['idf'])
+        new_tbd_idf = self.get_tbd_idf_matrix()[:, N_old:]
+
+        try:
+            self._extend_snippet_store(new_names)
+        except FileNotFoundError:
+            pass
+
+        for filetype, docs_matrix in ((FT.tbd_svd_matrix, new_tbd),
+                                      (FT.tbd_idf_svd_matrix, new_tbd_idf)):
+            try:
+                order = len(self._get_it(filetype)[1])
+            except FileNotFoundError:
+                continue
+
+            base_docs = state['svd_base_docs'].get(filetype.value, N_old)
+            if N - base_docs > svd_recompute_ratio * N:
+                print(f'too many documents folded into {filetype.value}, recomputing...')
+                if filetype == FT.tbd_svd_matrix:
+                    self.build_tbd_svd_matrix(order)
+                else:
+                    self.build_tbd_idf_svd_matrix(order)
+            else:
+                self._fold_in_svd(filetype, docs_matrix)
+
+        print(f'ingested {len(new_names)} documents')
+
+    @timed_stage('update_all')
+    def update_all(self, n_jobs: int = 1) -> None:
         self.index_documents()
-        self.preprocess_docs()
-        self.index_terms()
+        self.preprocess_docs(n_jobs=n_jobs)
         self.build_tbd_matrix()
         self.build_tbd_idf_matrix()
 
-    def query2bag_of_words(self, query: str) -> "np.array":
+    def _lookup_chunk(self, chunk: str) -> Tuple[int, ...]:
+        indexed_terms = self.get_indexed_terms()
+        term_ids = (indexed_terms.get(token) for token in self._preprocess_doc(chunk))
+        return tuple(term_id for term_id in term_ids if term_id is not None)
+
+    def _query_term_ids(self, query: str) -> List[int]:
+        # ids of indexed terms of query (with repetitions), query is tokenized
+        # chunk by chunk which only differs from tokenizing it whole for
+        # punctuation, that is filtered out anyway
+        term_ids = []
+        for chunk in query.split():
+            term_ids.extend(self._chunk_term_ids(chunk))
+        return term_ids
+
+    def query2term_ids(self, query: str) -> Tuple["np.array", "np.array"]:
+        # returns sorted ids of distinct indexed terms of query and their weights,
+        # same as nonzero entries of query2bag_of_words
+        # raises AttributeError if query doesn't contain any indexed terms
+        term_ids = self._query_term_ids(query)
+        if len(term_ids) == 0:
+            raise AttributeError(f'query: {query} contains no indexed terms')
+
+        term_ids, counts = np.unique(term_ids, return_counts=True)
+        return term_ids.astype(np.int32), counts / np.sqrt(np.dot(counts, counts))
+
+    def term_ids2bag_of_words(self, term_ids: "np.array", weights: "np.array") -> "sparse.csc_matrix":
+        # returns (M, 1) vector with given weights at sorted term_ids
+        return sparse.csc_matrix((weights, term_ids, [0, len(term_ids)]),
+                                 shape=(len(self.get_indexed_terms()), 1))
+
+    def query2bag_of_words(self, query: str) -> "sparse.csc_matrix":
         # returns normalized (M, 1) vector of terms
         # raises AttributeError if query doesn't contain any indexed terms
-        tokens = self._preprocess_doc(query)
-        indexed_terms = self.get_indexed_terms()
-        M = len(indexed_terms)
+        return self.term_ids2bag_of_words(*self.query2term_ids(query))
+
+    def queries2matrix(self, queries: List[str]) -> Tuple["sparse.csc_matrix", List[bool]]:
+        # returns (M, B) matrix with normalized bag of words of each query as column
+        # and whether each query contains any indexed terms (if not its column is zero)
+        rows, cols = array('i'), array('i')
+        found = []
+        for i, query in enumerate(queries):
+            term_ids = self._query_term_ids(query)
+            rows.extend(term_ids)
+            cols.extend([i] * len(term_ids))
+            found.append(len(term_ids) > 0)
+
+        # duplicate entries are summed up
+        Q = sparse.csc_matrix((np.ones(len(rows)), (np.frombuffer(rows, dtype=np.int32),
+                                                    np.frombuffer(cols, dtype=np.int32))),
+                              shape=(len(self.get_indexed_terms()), len(queries)))
+        return normalize(Q, axis=0), found
+
+    def _read_original_document(self, doc_name: str, max_len: int) -> Tuple[str, str, str]:
+        # returns link, title and at least max_len characters of content
+        # ending at the end of word
+        with open(pathlib.Path(self.RAW_DATA_DIR, doc_name), 'r') as f:
+            title = f.readline()
+            content = f.read(max_len)
+            while(True):
+                letter = f.read(1)
+                if letter.isalnum():
+                    content += letter
+                else:
+                    break
+
+        return decode_url(doc_name), title, content
+
+    def _pack_snippets(self, doc_names: List[str], max_len: int) -> Tuple["np.array", "np.array"]:
+        # returns blob with link, title and content of each document and lengths of these fields
+        chunks = []
+        for doc_name in doc_names:
+            for field in self._read_original_document(doc_name, max_len):
+                chunks.append(field.encode('utf-8'))
+
+        blob = np.frombuffer(b''.join(chunks), dtype=np.uint8)
+        return blob, np.array([len(chunk) for chunk in chunks], dtype=np.int64)
+
+    @timed_stage('build_snippet_store')
+    def build_snippet_store(self, max_len: int = 200) -> None:
+        # packs link, title and content of each document into one blob,
+        # fields of document idx are at offsets[3*idx:3*idx+4]
+        _, indexed_docs = self.get_doc_indices()
+        blob, lengths = self._pack_snippets(indexed_docs, max_len)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
 
-        result = sparse.lil_matrix((M, 1))
-        found = False
-        for token in tokens:
-            if token in indexed_terms:
-                found = True
-                result[indexed_terms[token], 0] += 1
+        self._save_it(FT.snippet_store, (blob, offsets, np.array([max_len])))
 
-        if not found:
-            raise AttributeError(f'query: {query} contains no indexed terms')
+        print(
+            f'saved snippets of documents at {self.paths[FT.snippet_store]}')
+
+    def _extend_snippet_store(self, doc_names: List[str]) -> None:
+        blob, offsets, max_len = self.get_snippet_store()
+        new_blob, lengths = self._pack_snippets(doc_names, max_len[0])
 
-        result /= scipy.sparse.linalg.norm(result)
-        return result.tocsc(copy=False)
+        self._save_it(FT.snippet_store, (np.concatenate((blob, new_blob)),
+                                         np.concatenate((offsets, offsets[-1] + np.cumsum(lengths))),
+                                         max_len))
+
+    def get_snippet_store(self) -> Tuple["np.array", "np.array", "np.array"]:
+        # returns blob, offsets and max_len the store was built with
+        return self._get_it(FT.snippet_store)
+
+    def has_snippet_store(self, max_len: int) -> bool:
+        try:
+            return self.get_snippet_store()[2][0] == max_len
+        except FileNotFoundError:
+            return False
 
     def get_original_documents(self, idxs: List[int], max_len: int = 200) -> Generator[List[
             Tuple[str, str, str]], None, None]:
-        _, indexed_docs = self.get_doc_indices()
+        if not self.has_snippet_store(max_len):
+            _, indexed_docs = self.get_doc_indices()
+            for idx in idxs:
+                yield self._read_original_document(indexed_docs[idx], max_len)
+            return
+
+        blob, offsets, _ = self.get_snippet_store()
         for idx in idxs:
-            doc_name = indexed_docs[idx]
-            raw_doc_path = pathlib.Path(self.RAW_DATA_DIR, doc_name)
-
-            with open(raw_doc_path, 'r') as f:
-                title = f.readline()
-                content = f.read(np.random.randint(
-                    max(max_len-80, 0), max_len))
-                while(True):
-                    letter = f.read(1)
-                    if letter.isalnum():
-                        content += letter
-                    else:
-                        break
-
-            link = decode_url(doc_name)
-            yield link, title, content
+            yield tuple(blob[offsets[i]:offsets[i+1]].tobytes().decode('utf-8')
+                        for i in range(3*idx, 3*idx+3))
 
     def has_svd_of_order(self, k: int) -> bool:
-        path = f'{self.paths[FT.tbd_svd_matrix]}_{k}'
+        # raises ValueError if k is not positive
+        check_order(k)
         try:
-            with open(path, 'r'):
-                return True
+            return all(len(self._get_it(filetype)[1]) >= k
+                       for filetype in (FT.tbd_svd_matrix, FT.tbd_idf_svd_matrix))
         except FileNotFoundError:
             return False
 
 
+# preprocessor of pool worker process, see Preprocessor.preprocess_docs
+_worker_preproc = None
+
+
+def _init_worker(config: Dict[str, Any]) -> None:
+    global _worker_preproc
+    _worker_preproc = Preprocessor(**config)
+
+
+def _preprocess_file_in_worker(task: Tuple[str, Tuple[bool, bool, bool, bool]]) -> Tuple[str, List[str]]:
+    name, options = task
+    return name, _worker_preproc._preprocess_file(name, *options)
+
+
+def check_order(k: int) -> None:
+    # raises ValueError if k can't be order of low rank approx
+    if k < 1:
+        raise ValueError(f'order of low rank approx has to be positive, got {k}')
+
+
+def low_rank_approx(U: "np.array", s: "np.array", VT: "np.array", k: int) -> Tuple["np.array", "np.array"]:
+    # returns U and (N, k) document vectors (diag(s) @ VT).T truncated to k singular values,
+    # each row normalized, as contiguous float32 array
+    # raises ValueError if k is not positive
+    check_order(k)
+    doc_vectors = np.ascontiguousarray(VT[:k].T * s[:k], dtype=np.float32)
+    normalize(doc_vectors, copy=False)
+
+    return U[:, :k], doc_vectors
+
+
+def extend_columns(matrix: "sparse.spmatrix", columns: "sparse.csc_matrix") -> "sparse.csc_matrix":
+    # appends columns, matrix gets zero rows for terms indexed after it was built
+    matrix = sparse.csc_matrix(matrix)
+    matrix = sparse.csc_matrix((matrix.data, matrix.indices, matrix.indptr),
+                               shape=(columns.shape[0], matrix.shape[1]))
+    return sparse.hstack((matrix, columns), format='csc')
+
+
 def encode_url(url: str) -> str:
     return urllib.parse.quote(url, safe='')
 
@@ -356,3 +866,10 @@ def save_binary(path: str, binary: Any) -> None:
 def load_binary(path: str) -> Any:
     with open(path, 'rb') as f:
         return pickle.load(f)
+
+
+def load_matrices(path: str) -> Any:
+    # matrices saved before array format was introduced are still pickled
+    if is_array_dir(path):
+        return load_arrays(path)
+    return load_binary(path)
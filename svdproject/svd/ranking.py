@@ -0,0 +1,34 @@
+import numpy as np
+
+
+def top_n(scores: "np.array", n: int) -> "np.array":
+    # returns indices of n greatest scores ordered by descending score,
+    # equal scores are ordered by ascending index (same as stable sort)
+    N = scores.shape[0]
+    n = min(n, N)
+    if n <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    if n < N:
+        threshold = np.partition(scores, N - n)[N - n]
+        above = np.flatnonzero(scores > threshold)
+        # only lowest indices of documents scored exactly at threshold fit in
+        ties = np.flatnonzero(scores == threshold)[:n - above.shape[0]]
+        candidates = np.concatenate((above, ties))
+    else:
+        candidates = np.arange(N)
+
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
+
+
+def count_matches(scores: "np.array", zero_tolerance: float) -> int:
+    return int(np.count_nonzero(scores > zero_tolerance))
+
+
+def merge_top_n(doc_idxs: "np.array", scores: "np.array", n: int) -> "np.array":
+    # returns positions of n best of candidates from several rankings ordered
+    # like top_n, if every ranking holds top n of its documents result is same
+    # as top_n of all documents
+    order = np.lexsort((doc_idxs, -scores))
+    return order[:n]
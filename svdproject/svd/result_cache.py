@@ -0,0 +1,69 @@
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional
+import threading
+import numpy as np
+
+
+class Ranking(NamedTuple):
+    doc_idxs: "np.array"  # ranked best first
+    similarities: "np.array"  # similarity of each of doc_idxs
+    results_count: int
+    # True if doc_idxs contains every document, so any offset can be served
+    complete: bool
+
+    @property
+    def nbytes(self) -> int:
+        return self.doc_idxs.nbytes + self.similarities.nbytes
+
+
+class RankingCache:
+    # LRU cache of rankings, bounded by total size of stored arrays
+    def __init__(self, max_bytes: int = 64 * 2**20) -> None:
+        self.max_bytes = max_bytes
+        self.mutex = threading.Lock()
+        self.entries: "OrderedDict[Any, Ranking]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any, n: int) -> Optional[Ranking]:
+        # returns ranking only if it holds at least n top documents
+        with self.mutex:
+            ranking = self.entries.get(key)
+            if ranking is None or (len(ranking.doc_idxs) < n and not ranking.complete):
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return ranking
+
+    def put(self, key: Any, ranking: Ranking) -> None:
+        if ranking.nbytes > self.max_bytes:
+            return
+
+        with self.mutex:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.nbytes
+
+            self.entries[key] = ranking
+            self.bytes += ranking.nbytes
+
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+
+    def clear(self) -> None:
+        with self.mutex:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self.mutex:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'bytes': self.bytes
+            }
@@ -1,8 +1,18 @@
-from .preprocessor import Preprocessor
+from .preprocessor import Preprocessor, FT, check_order
+from .ranking import top_n, count_matches
+from .result_cache import RankingCache, Ranking
+from .inverted_index import InvertedIndex
+from .sharding import ShardedIndex, search_dense
+from .ann import IVFIndex
+from .jobs import SVDJobManager
+from .shared_model import attach_model, current_version
+from .metrics import REGISTRY, NULL_STOPWATCH
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import threading
 import time
 from enum import Enum
-import threading
+from typing import Any, Callable, Dict, NamedTuple, Optional
 
 
 class Mode(Enum):
@@ -12,117 +22,529 @@ class Mode(Enum):
     SVD_IDF = 3
 
 
+SVD_MODES = (Mode.SVD, Mode.SVD_IDF)
+
+
+class SVDModel(NamedTuple):
+    # factors of one low rank order, queries see it through single reference
+    # so they never mix factors of different orders
+    k: int
+    U: "np.array"
+    doc_vectors: "np.array"
+    U_idf: "np.array"
+    doc_vectors_idf: "np.array"
+    ann_indices: Dict[Mode, IVFIndex]  # built with model, empty if ANN is disabled
+
+    def factors(self, mode: Mode):
+        if mode == Mode.SVD:
+            return self.U, self.doc_vectors
+        return self.U_idf, self.doc_vectors_idf
+
+
+class Snapshot(NamedTuple):
+    # everything queries read, replaced with single assignment so query that
+    # reads it once never mixes vocabulary, postings and factors of different
+    # versions of index (e.g. term ids of new vocabulary with old postings)
+    preproc: Preprocessor  # vocabulary and snippets
+    tbd_matrix: Any
+    tbd_index: Any
+    tbd_idf_matrix: Any
+    tbd_idf_index: Any
+    svd_model: Optional[SVDModel]
+    version: Optional[str] = None  # of attached shared model
+
+
+class ModeUnavailableError(Exception):
+    # raised for queries in modes whose data isn't loaded yet
+    pass
+
+
 class SearchEngine:
-    def __init__(self, k: int = 1000) -> None:
-        self.preproc = Preprocessor()
-        self.svd_mutex = threading.Lock()  # for updating low rank
+    # with shared_model_dir set, matrices and factors are mapped read only from
+    # model published there by svd.shared_model.publish_model and nothing is built
+    # with lazy set, constructor returns immediately and data is loaded on background
+    # thread, modes become available one by one (see available_modes)
+    # with n_shards > 1 documents are split into shards scored in parallel (see sharding)
+    # ann_lists and ann_pq_subspaces are passed to IVFIndex.build of every model,
+    # 0 ann_lists disables ANN and approximate queries are answered exactly
+    # with ingest_interval > 0 newly crawled documents and token shards are ingested
+    # every ingest_interval seconds on background thread once data is loaded
+    def __init__(self, k: int = 1000, shared_model_dir: str = None, lazy: bool = False,
+                 preproc: Preprocessor = None, n_shards: int = 1, ann_lists: int = None,
+                 ann_pq_subspaces: int = 0, ingest_interval: float = 0) -> None:
         # of characters that will be sent (excluding title)
         self.max_doc_len = 250
-        self.k = k
-        self._init_preproc_data()
         self.zero_tolerance = 1e-3  # for counting matches
-        self.computing_svd = False
+        # rankings are cached at least this deep so next pages are served from cache
+        self.ranking_depth = 1000
+        self.ranking_cache = RankingCache()
+        # lists of ann index searched by approximate queries
+        self.nprobe = 8
+        self.ann_lists = ann_lists
+        self.ann_pq_subspaces = ann_pq_subspaces
+        self.ingest_interval = ingest_interval
+        # one ingest at a time, each builds on index published by previous one
+        self.ingest_lock = threading.Lock()
+        self.shared_model_dir = shared_model_dir
+        # seconds between checks for newer shared model
+        self.shared_model_poll = 1.0
+        self.shared_model_checked = 0.0
+        self.n_shards = n_shards
+        self.shard_executor = ThreadPoolExecutor(
+            n_shards, thread_name_prefix='shard') if n_shards > 1 else None
+
+        self.available_modes = frozenset()
+        self.warm_up_stage = 'starting'
+        self.warm_up_error = None
+        self.snapshot = Snapshot(Preprocessor() if preproc is None else preproc,
+                                 None, None, None, None, None)
+        # serializes writers of snapshot, readers just take reference
+        self.publish_lock = threading.Lock()
+        # held by thread checking for newer shared model
+        self.refresh_lock = threading.Lock()
+
+        self.svd_jobs = SVDJobManager(
+            self._build_svd_model, self._publish_svd_model)
+
+        if lazy:
+            threading.Thread(target=self._warm_up, args=(k,), daemon=True).start()
+        else:
+            self._load_all(k)
 
-    def _init_preproc_data(self) -> None:
+    @property
+    def preproc(self) -> Preprocessor:
+        return self.snapshot.preproc
+
+    @property
+    def svd_model(self) -> Optional[SVDModel]:
+        return self.snapshot.svd_model
+
+    @property
+    def shared_model_version(self) -> Optional[str]:
+        return self.snapshot.version
+
+    def _publish(self, **changes: Any) -> None:
+        with self.publish_lock:
+            self.snapshot = self.snapshot._replace(**changes)
+
+    def _set_available(self, *modes: Mode) -> None:
+        # new set is swapped in, so readers never see it half updated
+        self.available_modes = self.available_modes | frozenset(modes)
+
+    def _load_all(self, k: int) -> None:
+        # in order in which data becomes needed: vocabulary, TF-IDF, TBD, SVD
+        if self.shared_model_dir is not None:
+            self.warm_up_stage = 'shared model'
+            self._attach_shared_model()
+            self._set_available(*Mode)
+        else:
+            self.warm_up_stage = 'vocabulary'
+            self._load_vocabulary()
+            self.warm_up_stage = 'tbd idf'
+            self._load_tbd_idf()
+            self._set_available(Mode.TBD_IDF)
+            self.warm_up_stage = 'tbd'
+            self._load_tbd()
+            self._set_available(Mode.TBD)
+            self.warm_up_stage = 'svd'
+            model = self._build_svd_model(k, preproc=self.preproc)
+            # order requested meanwhile wins over initial one
+            if self.svd_model is None:
+                self._publish_svd_model(model)
+            self.warm_up_stage = 'snippets'
+            self._load_snippets()
+            if self.ingest_interval > 0:
+                threading.Thread(target=self._ingest_periodically, daemon=True).start()
+        self.warm_up_stage = 'ready'
+
+    def _warm_up(self, k: int) -> None:
+        start = time.time()
+        try:
+            self._load_all(k)
+            print(f'warm up finished in {np.around(time.time() - start, 2)}s')
+        except Exception as e:
+            print(f'warm up failed at {self.warm_up_stage}: {e}')
+            self.warm_up_error = str(e)
+
+    def health(self) -> Dict[str, Any]:
+        # probes keep retrying attach of shared model even if no queries come
+        try:
+            self._refresh_shared_model()
+        except Exception as e:
+            print(f'attaching shared model failed: {e}')
+        return {
+            'ready': self.warm_up_stage == 'ready',
+            'stage': self.warm_up_stage,
+            'modes': [mode.name for mode in Mode if mode in self.available_modes],
+            'error': self.warm_up_error
+        }
+
+    def _load_vocabulary(self) -> None:
         try:
             # if this file is missing everything else should be missing too
             self.preproc.get_doc_indices()
         except FileNotFoundError:
             print('Preprocessed files not found. Preprocessing all...')
             self.preproc.update_all()
+        self.preproc.get_indexed_terms()
+
+    def _make_index(self, matrix):
+        if self.n_shards > 1:
+            return ShardedIndex(matrix, self.n_shards, self.shard_executor)
+        return InvertedIndex(matrix)
+
+    def _load_tbd_idf(self) -> None:
+        matrix = self.preproc.get_tbd_idf_matrix()
+        self._publish(tbd_idf_matrix=matrix, tbd_idf_index=self._make_index(matrix))
 
-        # self.preproc.build_tbd_matrix()
-        # self.preproc.build_tbd_idf_matrix()
-        # self.preproc.build_tbd_idf_svd_matrix(self.k)
-        # self.preproc.build_tbd_svd_matrix(self.k)
+    def _load_tbd(self) -> None:
+        matrix = self.preproc.get_tbd_matrix()
+        self._publish(tbd_matrix=matrix, tbd_index=self._make_index(matrix))
 
-        self.tbd_matrix = self.preproc.get_tbd_matrix()
-        self.tbd_idf_matrix = self.preproc.get_tbd_idf_matrix()
-        self._load_svds()
+    def _load_snippets(self, preproc: Preprocessor = None) -> None:
+        # until store is built snippets are read from raw documents
+        preproc = self.preproc if preproc is None else preproc
+        if not preproc.has_snippet_store(self.max_doc_len):
+            print('Snippet store not found. Building...')
+            preproc.build_snippet_store(self.max_doc_len)
 
-    def _load_svds(self):
+    def _publish_preproc(self, preproc: Preprocessor) -> None:
+        # index of preproc (e.g. after ingest) replaces current one, SVD model
+        # of same order is loaded from it, if there is any model yet
+        self._load_snippets(preproc)
+        tbd_matrix, tbd_idf_matrix = preproc.get_tbd_matrix(), preproc.get_tbd_idf_matrix()
+        model = self.svd_model
+        if model is not None:
+            model = self._build_svd_model(model.k, preproc=preproc)
+        snapshot = Snapshot(preproc, tbd_matrix, self._make_index(tbd_matrix),
+                            tbd_idf_matrix, self._make_index(tbd_idf_matrix), model)
+        with self.publish_lock:
+            self.snapshot = snapshot
+        self.ranking_cache.clear()
+        preproc.clear_svd_cache()
+        print(f'index of {tbd_matrix.shape[1]} documents published')
+
+    def _check_available(self, mode: Mode) -> None:
+        if mode not in self.available_modes:
+            raise ModeUnavailableError(
+                f'mode {mode.name} is not available yet (loading {self.warm_up_stage})')
+
+    def _attach_shared_model(self) -> None:
+        model = attach_model(self.shared_model_dir)
+        # new preprocessor, so memo of query term ids isn't shared with old vocabulary
+        preproc = Preprocessor(**self.preproc.config())
+        preproc.attach_files({
+            FT.indexed_terms: model.indexed_terms,
+            FT.snippet_store: model.snippet_store
+        })
+        # postings are csr already, so indices are built without copying them,
+        # ann indices are published with model (versions published without them
+        # answer approximate queries exactly)
+        ann_indices = {mode: index for mode, index in zip(SVD_MODES, (model.ann, model.ann_idf))
+                       if index is not None}
+        snapshot = Snapshot(preproc, model.tbd_postings, self._make_index(model.tbd_postings),
+                            model.tbd_idf_postings, self._make_index(model.tbd_idf_postings),
+                            SVDModel(model.k, *model.svd, *model.svd_idf, ann_indices), model.version)
+        with self.publish_lock:
+            self.snapshot = snapshot
+        self.ranking_cache.clear()
+        self._set_available(*Mode)
+        print(f'shared model {model.version} of order {model.k} attached')
+
+    def _refresh_shared_model(self) -> None:
+        # attaches newer published version, checked at most every shared_model_poll seconds
+        if self.shared_model_dir is None:
+            return
+        # attach of warm up is still running
+        if self.shared_model_version is None and self.warm_up_error is None:
+            return
+        if time.time() - self.shared_model_checked < self.shared_model_poll:
+            return
+        # one thread checks and attaches, others keep using current snapshot meanwhile
+        if not self.refresh_lock.acquire(blocking=False):
+            return
         try:
-            self.U, self.S = self.preproc.get_tbd_svd_matrix(self.k)
+            # another thread may have checked since
+            now = time.time()
+            if now - self.shared_model_checked < self.shared_model_poll:
+                return
+            self.shared_model_checked = now
+
+            if self.shared_model_version is None:
+                # nothing was published when warm up ran, attach first version once it is
+                try:
+                    self._attach_shared_model()
+                except FileNotFoundError:
+                    return
+                self.warm_up_error = None
+                self.warm_up_stage = 'ready'
+            elif current_version(self.shared_model_dir) != self.shared_model_version:
+                self._attach_shared_model()
+        finally:
+            self.refresh_lock.release()
+
+    def _build_svd_model(self, k: int, progress: Callable[[float, str], None] = None,
+                         preproc: Preprocessor = None) -> SVDModel:
+        # background builds use their own preprocessor, so they don't
+        # touch one that serves queries
+        if progress is None:
+            def progress(fraction, stage): pass
+        if preproc is None:
+            preproc = Preprocessor(**self.preproc.config())
+
+        progress(0.0, 'loading tbd svd')
+        try:
+            U, doc_vectors = preproc.get_tbd_svd_matrix(k)
         except FileNotFoundError:
-            print(f'TBD svd with k={self.k} not found. Building...')
-            self.preproc.build_tbd_svd_matrix(self.k)
-            self.U, self.S = self.preproc.get_tbd_svd_matrix(self.k)
+            print(f'TBD svd with k={k} not found. Building...')
+            progress(0.05, 'computing tbd svd')
+            preproc.build_tbd_svd_matrix(k)
+            U, doc_vectors = preproc.get_tbd_svd_matrix(k)
 
+        progress(0.45, 'loading idf svd')
         try:
-            self.U_idf, self.S_idf = self.preproc.get_tbd_idf_svd_matrix(
-                self.k)
+            U_idf, doc_vectors_idf = preproc.get_tbd_idf_svd_matrix(k)
         except FileNotFoundError:
-            print(f'IDF svd with k={self.k} not found. Building...')
-            self.preproc.build_tbd_idf_svd_matrix(self.k)
-            self.U_idf, self.S_idf = self.preproc.get_tbd_idf_svd_matrix(
-                self.k)
+            print(f'IDF svd with k={k} not found. Building...')
+            progress(0.5, 'computing idf svd')
+            preproc.build_tbd_idf_svd_matrix(k)
+            U_idf, doc_vectors_idf = preproc.get_tbd_idf_svd_matrix(k)
+
+        progress(0.9, 'loading ann indices')
+        ann_indices = {}
+        if self.ann_lists != 0:
+            ann_indices = dict(zip(SVD_MODES, preproc.load_ann_indices(
+                k, self.ann_lists, self.ann_pq_subspaces)))
+
+        progress(1.0, 'done')
+        return SVDModel(k, U, doc_vectors, U_idf, doc_vectors_idf, ann_indices)
+
+    def _publish_svd_model(self, model: SVDModel) -> None:
+        # swapping reference is atomic, queries hold on to snapshot they started with
+        # raises RuntimeError if model was built for other documents than current
+        # snapshot has (index was replaced while model was built)
+        with self.publish_lock:
+            matrix = self.snapshot.tbd_matrix
+            if matrix is not None and matrix.shape[1] != model.doc_vectors.shape[0]:
+                raise RuntimeError(f'svd model of order {model.k} was built for other version of index')
+            self.snapshot = self.snapshot._replace(svd_model=model)
+        # model may have been built by another preprocessor, serving one has to
+        # see its factors on disk for has_svd_of_order and ingest
+        self.preproc.clear_svd_cache()
+        self.ranking_cache.clear()
+        self._set_available(*SVD_MODES)
+        print(f'svd model of order {model.k} published')
 
     def set_low_rank_order(self, k: int):
-        self.svd_mutex.acquire()
-        if self.computing_svd:
-            self.svd_mutex.release()
-            return
-        self.computing_svd = True
-        self.svd_mutex.release()
+        # builds model in calling thread
+        self._publish_svd_model(self._build_svd_model(k))
 
-        print('loading......')
-        print(k)
-        self.k = k
-        self._load_svds()
-        print('done')
+    def request_low_rank_order(self, k: int) -> Dict[str, Any]:
+        # queues build of model for order k, returns status of its job
+        # raises RuntimeError if model is shared, its order is chosen by publisher,
+        # ValueError if k is not positive
+        self._check_not_shared()
+        check_order(k)
+        return self.svd_jobs.submit(k)
 
-        self.svd_mutex.acquire()
-        self.computing_svd = False
-        self.svd_mutex.release()
+    def svd_job_status(self, k: int = None) -> Any:
+        # raises KeyError if job for order k wasn't requested
+        return self.svd_jobs.status(k)
+
+    def _check_not_shared(self) -> None:
+        if self.shared_model_dir is not None:
+            raise RuntimeError(
+                'shared model can only be changed by publishing new one')
+
+    def ingest_new_documents(self, n_jobs: int = 1) -> int:
+        # indexes newly crawled documents without rebuilding everything, on separate
+        # preprocessor so queries use current snapshot until new one is published
+        # raises RuntimeError if model is shared, publisher ingests them
+        self._check_not_shared()
+        with self.ingest_lock:
+            preproc = Preprocessor(**self.preproc.config())
+            count = preproc.ingest_new_documents(n_jobs)
+            if count > 0:
+                self._publish_preproc(preproc)
+        return count
+
+    def ingest_token_shards(self, shard_dir: str = None) -> int:
+        # same as ingest_new_documents for documents streamed into token shards
+        self._check_not_shared()
+        with self.ingest_lock:
+            preproc = Preprocessor(**self.preproc.config())
+            count = preproc.ingest_token_shards(shard_dir)
+            if count > 0:
+                self._publish_preproc(preproc)
+        return count
+
+    def _ingest_periodically(self) -> None:
+        # stops once ingest_interval is set to 0
+        while self.ingest_interval > 0:
+            time.sleep(self.ingest_interval)
+            try:
+                self.ingest_new_documents()
+                self.ingest_token_shards()
+            except Exception as e:
+                print(f'ingest failed: {e}')
 
     def has_svd_of_order(self, k: int):
+        # raises ValueError if k is not positive
+        check_order(k)
+        if self.shared_model_dir is not None:
+            return self.get_svd_order() == k
         return self.preproc.has_svd_of_order(k)
 
     def get_svd_order(self):
-        return self.k
+        # None until first model is loaded
+        return self.svd_model.k if self.svd_model is not None else None
+
+    def _query_vector(self, q, U):
+        # q is (term ids, weights) pair of query,
+        # only rows of U for terms present in query are needed
+        term_ids, weights = q
+        return weights.astype(np.float32) @ U[term_ids]
+
+    def _project(self, q, U, doc_vectors):
+        return doc_vectors @ self._query_vector(q, U)
+
+    def _approximate_ranking(self, q, depth, model, mode, nprobe):
+        U, doc_vectors = model.factors(mode)
+        doc_idxs, similarities, results_count = model.ann_indices[mode].search(
+            self._query_vector(q, U), depth, nprobe, doc_vectors, self.zero_tolerance)
+        # fewer documents than asked for means probed lists were exhausted
+        return Ranking(doc_idxs, similarities, results_count, len(doc_idxs) < depth)
 
-    def _compute_results(self, q, mode):
-        res = None
+    def _compute_results(self, q, snapshot, mode):
+        # similarities to all documents in SVD modes, TBD modes are scored by inverted index
+        return self._project(q, *snapshot.svd_model.factors(mode))
 
+    def score_batch(self, Q, mode, snapshot=None):
+        # returns (B, N) similarities of each column of (M, B) queries matrix to each document,
+        # Q has to be built by preprocessor of snapshot (defaults to current one)
+        # raises ModeUnavailableError if mode isn't loaded yet
+        self._check_available(mode)
+        snapshot = self.snapshot if snapshot is None else snapshot
         if mode == Mode.TBD:
-            res = q.T @ self.tbd_matrix
-        elif mode == Mode.TBD_IDF:
-            res = q.T @ self.tbd_idf_matrix
+            return (Q.T @ snapshot.tbd_matrix).toarray()
+        if mode == Mode.TBD_IDF:
+            return (Q.T @ snapshot.tbd_idf_matrix).toarray()
 
-        if res is not None:
-            return np.array(res.todense())
+        U, doc_vectors = snapshot.svd_model.factors(mode)
+        return np.asarray(Q.T @ U, dtype=np.float32) @ doc_vectors.T
 
-        if mode == Mode.SVD:
-            return q.T @ self.U @ self.S
+    def _get_ranking(self, q, n, snapshot, mode, approximate, nprobe, watch=NULL_STOPWATCH):
+        # term ids are sorted, so queries with same bag of words share key,
+        # svd model is only used (and may be None) in TBD modes; preprocessor is
+        # replaced with every new index, so queries still running on old snapshot
+        # can't put their rankings under keys of new one
+        term_ids, weights = q
+        model = snapshot.svd_model
+        order = model.k if mode in SVD_MODES else None
+        key = (id(snapshot.preproc), term_ids.tobytes(), weights.tobytes(), mode, order,
+               approximate, nprobe)
+        ranking = self.ranking_cache.get(key, n)
+        watch.lap('cache')
+        if ranking is not None:
+            return ranking
+
+        depth = max(n, self.ranking_depth)
 
-        return q.T @ self.U_idf @ self.S_idf
+        if mode in (Mode.TBD, Mode.TBD_IDF):
+            index = snapshot.tbd_index if mode == Mode.TBD else snapshot.tbd_idf_index
+            ranking = Ranking(*index.search(term_ids, weights, depth, self.zero_tolerance),
+                              depth >= index.n_docs)
+            watch.lap('score')
+        elif approximate:
+            ranking = self._approximate_ranking(q, depth, model, mode, nprobe)
+            watch.lap('score')
+        elif self.n_shards > 1:
+            U, doc_vectors = model.factors(mode)
+            doc_idxs, similarities, results_count = search_dense(
+                doc_vectors, self._query_vector(q, U), depth, self.n_shards,
+                self.shard_executor, self.zero_tolerance)
+            ranking = Ranking(doc_idxs, similarities, results_count,
+                              depth >= doc_vectors.shape[0])
+            watch.lap('score')
+        else:
+            similarities = np.asarray(self._compute_results(q, snapshot, mode)).ravel()
+            watch.lap('score')
+            doc_idxs = top_n(similarities, depth)
+            ranking = Ranking(doc_idxs, similarities[doc_idxs],
+                              count_matches(similarities, self.zero_tolerance),
+                              depth >= similarities.shape[0])
+            watch.lap('sort')
 
-    def handle_query(self, query: str, offset: int = 0, k: int = 20, mode: Mode = Mode.SVD_IDF):
+        self.ranking_cache.put(key, ranking)
+        return ranking
+
+    def handle_query(self, query: str, offset: int = 0, k: int = 20, mode: Mode = Mode.SVD_IDF,
+                     approximate: bool = False, nprobe: int = None, timings: bool = False):
+        # approximate applies only to SVD modes, nprobe defaults to self.nprobe
+        # timings adds milliseconds spent in each stage of query to response
+        # raises ModeUnavailableError if mode isn't loaded yet
         start = time.time()
-        q = self.preproc.query2bag_of_words(query)
-        similarities = self._compute_results(q, mode)
+        watch = REGISTRY.stopwatch(force=timings)
+        self._check_available(mode)
+        self._refresh_shared_model()
+        # read once, everything below uses same version of index
+        snapshot = self.snapshot
+        model = snapshot.svd_model
+        # without ann index of model query is answered exactly
+        approximate = approximate and mode in SVD_MODES and mode in model.ann_indices
+        nprobe = (self.nprobe if nprobe is None else nprobe) if approximate else None
 
-        to_sort = [(i, similarity)
-                   for i, similarity in enumerate(similarities[0])]
-        to_sort.sort(key=lambda x: x[1], reverse=True)
+        try:
+            q = snapshot.preproc.query2term_ids(query)
+            watch.lap('tokenize')
+            ranking = self._get_ranking(
+                q, offset+k, snapshot, mode, approximate, nprobe, watch)
+        except Exception as e:
+            REGISTRY.inc('searchvd_query_errors_total', mode=mode.name, error=type(e).__name__)
+            raise
 
-        doc_idxs = [idx for idx, _ in to_sort[offset:offset+k]]
+        doc_idxs = ranking.doc_idxs[offset:offset+k]
 
-        links, titles, contents = zip(*list(
-            self.preproc.get_original_documents(doc_idxs, self.max_doc_len)))
-        correls = [sim for _, sim in to_sort[offset:offset+k]]
+        docs = list(snapshot.preproc.get_original_documents(doc_idxs, self.max_doc_len))
+        watch.lap('snippets')
+        links, titles, contents = zip(*docs) if len(docs) > 0 else ((), (), ())
+        correls = ranking.similarities[offset:offset+k].tolist()
 
         time_taken = time.time() - start
-        results = len([_ for _, sim in to_sort if sim > self.zero_tolerance])
+        results = ranking.results_count
 
-        return {
+        labels = {'mode': mode.name, 'order': model.k if mode in SVD_MODES else '',
+                  'approximate': approximate}
+        watch.observe(REGISTRY, 'searchvd_query_stage_seconds', **labels)
+        REGISTRY.observe('searchvd_query_seconds', time_taken, **labels)
+        REGISTRY.inc('searchvd_queries_total', **labels)
+
+        response = {
             'links': links,
             'titles': titles,
             'contents': contents,
             'correlations': correls,
             'time': np.around(time_taken, 2),
-            'results_count': results
+            'results_count': results,
+            'approximate': approximate
         }
+        if timings:
+            response['timings'] = watch.milliseconds()
+        return response
+
+    def export_metrics(self) -> str:
+        # current state gauges are taken at scrape time
+        cache = self.ranking_cache.stats()
+        REGISTRY.set('searchvd_ranking_cache_entries', cache['entries'])
+        REGISTRY.set('searchvd_ranking_cache_bytes', cache['bytes'])
+        REGISTRY.set('searchvd_ranking_cache_hits_total', cache['hits'])
+        REGISTRY.set('searchvd_ranking_cache_misses_total', cache['misses'])
+        if self.svd_model is not None:
+            REGISTRY.set('searchvd_svd_order', self.svd_model.k)
+        for mode in Mode:
+            REGISTRY.set('searchvd_mode_available',
+                         int(mode in self.available_modes), mode=mode.name)
+        return REGISTRY.render()
 
 
 def main():
@@ -0,0 +1,63 @@
+from concurrent.futures import Executor
+from typing import List, Tuple
+import numpy as np
+import scipy.sparse as sparse
+from .inverted_index import InvertedIndex, doc_positions
+from .ranking import top_n, count_matches, merge_top_n
+
+# Documents split into shards of consecutive columns, every shard is scored
+# on its own (in parallel on executor) and only top n of each shard are
+# merged, so query work is spread over cores. Merged ranking is same as
+# ranking of unsharded index up to float rounding. Posting lists of shard
+# are slices of shared postings arrays, shards only add bounds of their
+# slices and maximal weights (few arrays of vocabulary size each).
+
+
+def shard_bounds(n_docs: int, n_shards: int) -> "np.array":
+    # first document of each shard and n_docs at the end, shards differ by at most one document
+    return np.linspace(0, n_docs, max(1, min(n_shards, n_docs)) + 1).astype(np.int64)
+
+
+def _merge(results: List[Tuple["np.array", "np.array", int]], n: int) -> Tuple["np.array", "np.array", int]:
+    # results hold global indices of shard top n
+    doc_idxs = np.concatenate([result[0] for result in results])
+    similarities = np.concatenate([result[1] for result in results])
+    best = merge_top_n(doc_idxs, similarities, n)
+    return doc_idxs[best], similarities[best], sum(result[2] for result in results)
+
+
+class ShardedIndex:
+    # InvertedIndex of each shard of (M, N) matrix, searched like InvertedIndex
+    def __init__(self, matrix: "sparse.spmatrix", n_shards: int, executor: Executor,
+                 prune: bool = True) -> None:
+        self.n_docs = matrix.shape[1]
+        self.executor = executor
+        self.bounds = shard_bounds(self.n_docs, n_shards)
+        # csr postings (e.g. of shared model) are used as they are
+        postings = sparse.csr_matrix(matrix)
+        postings.sort_indices()
+        positions = doc_positions(postings, self.bounds)
+        self.shards = [InvertedIndex(postings, prune, (self.bounds[i], self.bounds[i+1]),
+                                     (positions[i], positions[i+1]))
+                       for i in range(len(self.bounds) - 1)]
+
+    def search(self, term_idxs: "np.array", term_weights: "np.array", n: int,
+               zero_tolerance: float) -> Tuple["np.array", "np.array", int]:
+        # same as InvertedIndex.search, shards return global indices of documents
+        results = self.executor.map(lambda shard: shard.search(term_idxs, term_weights, n, zero_tolerance),
+                                    self.shards)
+        return _merge(list(results), n)
+
+
+def search_dense(doc_vectors: "np.array", query_vector: "np.array", n: int, n_shards: int,
+                 executor: Executor, zero_tolerance: float) -> Tuple["np.array", "np.array", int]:
+    # returns n documents most similar to query vector ordered like top_n,
+    # their similarities and count of matches, shards are row ranges of doc_vectors
+    bounds = shard_bounds(doc_vectors.shape[0], n_shards)
+
+    def search_shard(i: int) -> Tuple["np.array", "np.array", int]:
+        similarities = doc_vectors[bounds[i]:bounds[i+1]] @ query_vector
+        best = top_n(similarities, n)
+        return best + bounds[i], similarities[best], count_matches(similarities, zero_tolerance)
+
+    return _merge(list(executor.map(search_shard, range(len(bounds) - 1))), n)
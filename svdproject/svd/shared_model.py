@@ -0,0 +1,121 @@
+from typing import Any, NamedTuple, Optional, Tuple
+import json
+import os
+import shutil
+import numpy as np
+import scipy.sparse as sparse
+from .ann import IVFIndex
+from .array_store import save_arrays, load_arrays, is_array_dir
+from .lexicon import CompactLexicon, save_lexicon, load_lexicon
+from .preprocessor import Preprocessor
+from .weighting import document_frequencies
+
+# Query time model published by one loader process into directory on shared
+# memory (tmpfs), every server worker maps same files read only. Each publish
+# writes new version directory and then atomically replaces CURRENT file with
+# its name, so workers only ever attach to complete versions.
+
+DEFAULT_ROOT = '/dev/shm/searchvd'
+CURRENT = 'CURRENT'
+MANIFEST = 'model.json'
+
+
+class SharedModel(NamedTuple):
+    version: str
+    k: int
+    tbd_postings: "sparse.csr_matrix"  # normalized (M, N) matrices as csr
+    tbd_idf_postings: "sparse.csr_matrix"
+    svd: Tuple["np.array", "np.array"]  # U and document vectors
+    svd_idf: Tuple["np.array", "np.array"]
+    snippet_store: Tuple["np.array", "np.array", "np.array"]
+    indexed_terms: CompactLexicon
+    # of svd and svd_idf document vectors, None in versions published without them
+    ann: Optional[IVFIndex]
+    ann_idf: Optional[IVFIndex]
+
+
+def _postings(matrix: "sparse.spmatrix") -> "sparse.csr_matrix":
+    postings = sparse.csr_matrix(matrix, copy=True)
+    postings.sort_indices()
+    return postings
+
+
+def current_version(root: str = DEFAULT_ROOT) -> str:
+    # raises FileNotFoundError if nothing was published in root yet
+    with open(os.path.join(root, CURRENT), 'r') as f:
+        return f.read().strip()
+
+
+def _versions(root: str) -> list:
+    return sorted(name for name in os.listdir(root)
+                  if name.startswith('v') and name[1:].isdigit())
+
+
+def publish_model(preproc: Preprocessor, k: int, root: str = DEFAULT_ROOT, keep: int = 2,
+                  ann_lists: int = None, ann_pq_subspaces: int = 0) -> str:
+    # returns name of published version, only keep newest versions are left in root
+    # (older ones stay mapped by workers that didn't refresh yet)
+    # ann indices are built with ann_lists and ann_pq_subspaces (see IVFIndex.build)
+    # if they weren't saved yet, 0 ann_lists publishes model without them
+    os.makedirs(root, exist_ok=True)
+    versions = _versions(root)
+    version = f'v{int(versions[-1][1:]) + 1 if len(versions) > 0 else 1:06d}'
+
+    tmp_path = os.path.join(root, f'{version}.tmp')
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.mkdir(tmp_path)
+
+    save_arrays(os.path.join(tmp_path, 'tbd_postings'),
+                _postings(preproc.get_tbd_matrix()))
+    save_arrays(os.path.join(tmp_path, 'tbd_idf_postings'),
+                _postings(preproc.get_tbd_idf_matrix()))
+    save_arrays(os.path.join(tmp_path, 'svd'), preproc.get_tbd_svd_matrix(k))
+    save_arrays(os.path.join(tmp_path, 'svd_idf'),
+                preproc.get_tbd_idf_svd_matrix(k))
+    save_arrays(os.path.join(tmp_path, 'snippet_store'),
+                preproc.get_snippet_store())
+    indexed_terms = preproc.get_indexed_terms()
+    if not isinstance(indexed_terms, CompactLexicon):
+        # vocabulary of older build
+        indexed_terms = CompactLexicon.build(indexed_terms, document_frequencies(
+            sparse.csc_matrix(preproc.get_tbd_matrix())))
+    save_lexicon(os.path.join(tmp_path, 'indexed_terms'), indexed_terms)
+    if ann_lists != 0:
+        ann, ann_idf = preproc.load_ann_indices(k, ann_lists, ann_pq_subspaces)
+        save_arrays(os.path.join(tmp_path, 'ann'), ann.to_arrays())
+        save_arrays(os.path.join(tmp_path, 'ann_idf'), ann_idf.to_arrays())
+
+    with open(os.path.join(tmp_path, MANIFEST), 'w') as f:
+        json.dump({'version': version, 'k': k}, f)
+
+    os.rename(tmp_path, os.path.join(root, version))
+
+    current_tmp = os.path.join(root, f'{CURRENT}.tmp')
+    with open(current_tmp, 'w') as f:
+        f.write(version)
+    os.replace(current_tmp, os.path.join(root, CURRENT))
+
+    for old in _versions(root)[:-keep]:
+        shutil.rmtree(os.path.join(root, old))
+
+    print(f'published model {version} with k={k} at {root}')
+    return version
+
+
+def attach_model(root: str = DEFAULT_ROOT) -> SharedModel:
+    # maps current version read only
+    # raises FileNotFoundError if nothing was published in root yet
+    path = os.path.join(root, current_version(root))
+    with open(os.path.join(path, MANIFEST), 'r') as f:
+        manifest = json.load(f)
+
+    def load(name: str) -> Any:
+        return load_arrays(os.path.join(path, name))
+
+    def load_ann(name: str) -> Optional[IVFIndex]:
+        return IVFIndex.from_arrays(load(name)) if is_array_dir(os.path.join(path, name)) else None
+
+    return SharedModel(manifest['version'], manifest['k'], load('tbd_postings'), load('tbd_idf_postings'),
+                       load('svd'), load('svd_idf'), load('snippet_store'),
+                       load_lexicon(os.path.join(path, 'indexed_terms')),
+                       load_ann('ann'), load_ann('ann_idf'))
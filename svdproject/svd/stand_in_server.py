@@ -0,0 +1,68 @@
+from typing import List
+import argparse
+import random
+from aiohttp import web
+
+# Local stand-in for BBC news serving deterministic canned pages with the
+# same markup that crawler.extract_text_content looks for, for running
+# crawlers without network, e.g.
+#   python -m svd.stand_in_server --port 8081
+#   python manage.py crawl --prefix http://127.0.0.1:8081 --start /news/story-0
+
+WORDS = ['government', 'election', 'market', 'climate', 'football', 'health', 'police',
+         'court', 'minister', 'economy', 'storm', 'school', 'energy', 'vote', 'price',
+         'report', 'city', 'league', 'border', 'science', 'company', 'war', 'talks', 'record']
+
+
+def _story(i: int, n_pages: int, links_per_page: int, seed: int) -> str:
+    rng = random.Random(seed * 1_000_003 + i)
+    title = ' '.join(rng.choice(WORDS) for _ in range(5)).capitalize()
+    paragraphs = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(10, 40)))
+                  for _ in range(rng.randint(2, 6))]
+    links = [f'/news/story-{rng.randrange(n_pages)}' for _ in range(links_per_page)]
+    # links crawlers should skip
+    links += ['/sport/results', 'https://www.example.com/news/elsewhere', '#top']
+
+    # every tenth page is index page without article
+    article = '' if i % 10 == 9 else (
+        f'<article><h1 id="main-heading">{title}</h1>' +
+        ''.join(f'<div data-component="text-block"><p>{p}</p></div>' for p in paragraphs) +
+        '</article>')
+
+    return ('<html><head><title>BBC News</title></head><body>' +
+            f'<div id="main-content">{article}</div>' +
+            '<nav>' + ''.join(f'<a href="{link}">link</a>' for link in links) + '</nav>' +
+            '</body></html>')
+
+
+def make_app(n_pages: int = 1000, links_per_page: int = 5, seed: int = 0,
+             error_every: int = 0) -> web.Application:
+    # pages are /news/story-0 to /news/story-{n_pages-1}, with error_every > 0
+    # every error_every-th page answers 500
+    async def story(request: web.Request) -> web.Response:
+        slug = request.match_info['slug']
+        if not slug.startswith('story-') or not slug[6:].isdigit() or int(slug[6:]) >= n_pages:
+            raise web.HTTPNotFound()
+        i = int(slug[6:])
+        if error_every > 0 and i % error_every == error_every - 1:
+            raise web.HTTPInternalServerError()
+        return web.Response(text=_story(i, n_pages, links_per_page, seed), content_type='text/html')
+
+    app = web.Application()
+    app.router.add_get('/news/{slug}', story)
+    return app
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--links', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    web.run_app(make_app(args.pages, args.links, args.seed), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
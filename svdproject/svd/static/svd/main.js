@@ -11,6 +11,8 @@ const [searchContent, searchViewForm, searchViewInput, resultInfo, moreDiv,
 
 const SEARCH_ENDPOINT = '/search';
 const SETTINGS_ENDPOINT = '/settings';
+const SETTINGS_STATUS_ENDPOINT = '/settings/status';
+const STATUS_POLL_INTERVAL = 2000;
 const pageLimit = 10;
 let mode = sessionStorage.getItem('mode');
 if (mode === null) {
@@ -74,14 +76,40 @@ settings.addEventListener('submit', async e => {
         }).then(x => x.json());
 
         console.log(resp);
-        if (resp['computed'] === false)
+        if (resp['error'] !== undefined) {
+            popup(resp['error']);
+            toggleSettings();
+            return;
+        }
+        if (resp['computed'] === false) {
             popup('this may take a while');
+            pollSVDJob(+k);
+        }
 
         curSVDOrd = k;
     }
     toggleSettings();
 });
 
+function pollSVDJob(k) {
+    const interval = setInterval(async () => {
+        try {
+            const job = await fetch(`${SETTINGS_STATUS_ENDPOINT}?order=${k}`).then(x => x.json());
+            if (job['state'] === 'done') {
+                clearInterval(interval);
+                popup(`low rank approx of order ${k} is ready`);
+            }
+            else if (job['state'] === 'failed' || job['state'] === undefined) {
+                clearInterval(interval);
+                popup(`failed to compute low rank approx of order ${k}`);
+            }
+        } catch (err) {
+            console.log(err);
+            clearInterval(interval);
+        }
+    }, STATUS_POLL_INTERVAL);
+}
+
 async function handleSearchQuery(query, offset = 0) {
     query = query.trim();
     if (query.length == 0)
@@ -0,0 +1,94 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.sparse as sparse
+from .inverted_index import InvertedIndex
+from .ranking import top_n, count_matches
+from .sharding import ShardedIndex
+
+# Searches of inverted index (with and without MaxScore pruning) and of sharded
+# index are compared to top_n over scores of all documents. Weights are small
+# integers, so sums are exact and order of tied documents is compared too.
+
+ZERO_TOLERANCE = 0.5
+
+
+def random_matrix(rng: "np.random.Generator", n_terms: int = 60, n_docs: int = 500) -> "sparse.csc_matrix":
+    # first terms are frequent, so their lists get pruned
+    density = np.where(np.arange(n_terms) < 5, 0.5, 0.03)
+    mask = rng.random((n_terms, n_docs)) < density[:, np.newaxis]
+    return sparse.csc_matrix((rng.integers(1, 5, (n_terms, n_docs)) * mask).astype(np.float64))
+
+
+def random_queries(rng: "np.random.Generator", n_terms: int, n_queries: int = 200) -> list:
+    # (sorted term ids, weights) pairs like Preprocessor.query2term_ids
+    queries = []
+    for _ in range(n_queries):
+        term_idxs = np.unique(rng.integers(0, n_terms, rng.integers(1, 6)))
+        queries.append((term_idxs, rng.integers(1, 4, len(term_idxs)).astype(np.float64)))
+    return queries
+
+
+class IndexSearchTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(0)
+        cls.matrix = random_matrix(rng)
+        cls.queries = random_queries(rng, cls.matrix.shape[0])
+        cls.executor = ThreadPoolExecutor(4)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.shutdown()
+
+    def assert_brute_force(self, index, matrix: "sparse.csc_matrix", queries: list, n: int) -> None:
+        for term_idxs, term_weights in queries:
+            scores = np.asarray(matrix[term_idxs].T @ term_weights).ravel()
+            expected = top_n(scores, n)
+            doc_idxs, similarities, count = index.search(term_idxs, term_weights, n, ZERO_TOLERANCE)
+
+            np.testing.assert_array_equal(doc_idxs, expected)
+            np.testing.assert_array_equal(similarities, scores[expected])
+            self.assertEqual(count, count_matches(scores, ZERO_TOLERANCE))
+
+    def test_pruned(self):
+        index = InvertedIndex(self.matrix, prune=True)
+        for n in (1, 5, 20, 100):
+            self.assert_brute_force(index, self.matrix, self.queries, n)
+
+    def test_not_pruned(self):
+        index = InvertedIndex(self.matrix, prune=False)
+        for n in (1, 5, 20, 100):
+            self.assert_brute_force(index, self.matrix, self.queries, n)
+
+    def test_sharded(self):
+        for n_shards in (1, 3, 7):
+            index = ShardedIndex(self.matrix, n_shards, self.executor)
+            for n in (1, 5, 100):
+                self.assert_brute_force(index, self.matrix, self.queries, n)
+        # more shards than documents, most shards have single document
+        index = ShardedIndex(self.matrix, 600, self.executor)
+        self.assert_brute_force(index, self.matrix, self.queries[:10], 5)
+
+    def test_fewer_matches_than_n(self):
+        # documents with zero score fill up ranking in ascending order of index
+        queries = [(np.array([term]), np.array([1.0])) for term in range(5, 15)]
+        n = 50
+        for term_idxs, _ in queries:
+            self.assertLess(self.matrix[term_idxs].nnz, n)
+
+        self.assert_brute_force(InvertedIndex(self.matrix), self.matrix, queries, n)
+        self.assert_brute_force(ShardedIndex(self.matrix, 3, self.executor), self.matrix, queries, n)
+
+    def test_ties(self):
+        # equal scores are ordered by ascending index, also across shards
+        matrix = sparse.csc_matrix(np.array([[0, 2, 0, 2, 1, 2, 0, 2],
+                                             [1, 0, 0, 0, 1, 0, 0, 0]], dtype=np.float64))
+        term_idxs, term_weights = np.array([0]), np.array([1.0])
+        for index in (InvertedIndex(matrix), ShardedIndex(matrix, 3, self.executor)):
+            doc_idxs, similarities, count = index.search(term_idxs, term_weights, 3, ZERO_TOLERANCE)
+            np.testing.assert_array_equal(doc_idxs, [1, 3, 5])
+            np.testing.assert_array_equal(similarities, [2, 2, 2])
+            self.assertEqual(count, 5)
+
+        self.assert_brute_force(InvertedIndex(matrix), matrix, [(np.array([0, 1]), np.array([1.0, 1.0]))], 6)
@@ -0,0 +1,140 @@
+from array import array
+from typing import Dict, Iterator, List, NamedTuple
+import os
+import numpy as np
+from .array_store import save_arrays, load_arrays, is_array_dir
+
+# Tokenized documents stored in rolling shards: each shard packs token ids of
+# many documents into one int32 array with offsets of each document, so
+# building matrices reads few large files instead of file per document.
+# Token ids refer to append-only lexicon shared by all shards of directory,
+# lexicon is flushed before shard using its new terms is written, so every
+# complete shard can be read even if writer was interrupted.
+
+LEXICON_FN = 'lexicon.txt'
+SHARD_PREFIX = 'shard_'
+# tokens buffered before shard is written (64MB of ids)
+MAX_SHARD_TOKENS = 1 << 24
+
+
+class Shard(NamedTuple):
+    names: List[str]
+    # tokens of document i are token_ids[doc_offsets[i]:doc_offsets[i+1]]
+    token_ids: "np.array"
+    doc_offsets: "np.array"
+
+
+class Lexicon:
+    # term ids are line numbers of terms in lexicon file
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.terms: List[str] = []
+        if os.path.isfile(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.terms = f.read().splitlines()
+        self.term_ids: Dict[str, int] = {term: i for i, term in enumerate(self.terms)}
+        self.n_saved = len(self.terms)
+
+    def ids(self, tokens: List[str]) -> "np.array":
+        # new terms get next ids, they are saved by flush
+        term_ids = self.term_ids
+        ids = array('i')
+        for token in tokens:
+            term_id = term_ids.get(token)
+            if term_id is None:
+                term_id = term_ids[token] = len(self.terms)
+                self.terms.append(token)
+            ids.append(term_id)
+        return np.frombuffer(ids, dtype=np.int32)
+
+    def flush(self) -> None:
+        if self.n_saved == len(self.terms):
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(f'{term}\n' for term in self.terms[self.n_saved:]))
+            f.flush()
+            os.fsync(f.fileno())
+        self.n_saved = len(self.terms)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+
+def shard_paths(shard_dir: str) -> List[str]:
+    # complete shards in order they were written
+    if not os.path.isdir(shard_dir):
+        return []
+    names = sorted(name for name in os.listdir(shard_dir)
+                   if name.startswith(SHARD_PREFIX) and not name.endswith('.tmp'))
+    return [os.path.join(shard_dir, name) for name in names
+            if is_array_dir(os.path.join(shard_dir, name))]
+
+
+def save_shard(path: str, names: List[str], token_ids: "np.array", doc_offsets: "np.array") -> None:
+    encoded = [name.encode('utf-8') for name in names]
+    name_blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    name_offsets = np.concatenate(([0], np.cumsum([len(name) for name in encoded]))).astype(np.int64)
+    save_arrays(path, (np.asarray(token_ids, dtype=np.int32), np.asarray(doc_offsets, dtype=np.int64),
+                       name_blob, name_offsets))
+
+
+def load_shard(path: str) -> Shard:
+    # token ids and offsets stay memory mapped
+    token_ids, doc_offsets, name_blob, name_offsets = load_arrays(path)
+    blob = name_blob.tobytes()
+    names = [blob[start:end].decode('utf-8')
+             for start, end in zip(name_offsets[:-1], name_offsets[1:])]
+    return Shard(names, token_ids, doc_offsets)
+
+
+def read_shards(shard_dir: str, start: int = 0) -> Iterator[Shard]:
+    # shards from start-th one on
+    for path in shard_paths(shard_dir)[start:]:
+        yield load_shard(path)
+
+
+def read_lexicon(shard_dir: str) -> List[str]:
+    return Lexicon(os.path.join(shard_dir, LEXICON_FN)).terms
+
+
+class ShardWriter:
+    # appends tokenized documents to shard_dir, shard is written every
+    # max_tokens tokens and by flush
+    def __init__(self, shard_dir: str, max_tokens: int = MAX_SHARD_TOKENS) -> None:
+        os.makedirs(shard_dir, exist_ok=True)
+        self.shard_dir = shard_dir
+        self.max_tokens = max_tokens
+        self.lexicon = Lexicon(os.path.join(shard_dir, LEXICON_FN))
+        self.next_shard = len(shard_paths(shard_dir))
+        self._reset()
+
+    def _reset(self) -> None:
+        self.names: List[str] = []
+        self.token_ids: List["np.array"] = []
+        self.n_tokens = 0
+
+    def append(self, name: str, tokens: List[str]) -> None:
+        ids = self.lexicon.ids(tokens)
+        self.names.append(name)
+        self.token_ids.append(ids)
+        self.n_tokens += len(ids)
+        if self.n_tokens >= self.max_tokens:
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self.names) == 0:
+            return
+        self.lexicon.flush()
+
+        lengths = [len(ids) for ids in self.token_ids]
+        doc_offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        token_ids = np.concatenate(self.token_ids) if self.n_tokens > 0 else np.zeros(0, dtype=np.int32)
+        path = os.path.join(self.shard_dir, f'{SHARD_PREFIX}{self.next_shard:06d}')
+        save_shard(path, self.names, token_ids, doc_offsets)
+        print(f'saved {len(self.names)} documents to {path}')
+
+        self.next_shard += 1
+        self._reset()
+
+    def close(self) -> None:
+        self.flush()
@@ -1,8 +1,11 @@
 from django.urls import path
-from .views import main, SearchQuery, SettingsQuery
+from .views import main, metrics, SearchQuery, SettingsQuery, SettingsStatusQuery, HealthQuery
 
 urlpatterns = [
     path('', main),
     path('search', SearchQuery.as_view()),
-    path('settings', SettingsQuery.as_view())
+    path('settings', SettingsQuery.as_view()),
+    path('settings/status', SettingsStatusQuery.as_view()),
+    path('health', HealthQuery.as_view()),
+    path('metrics', metrics)
 ]
@@ -1,24 +1,51 @@
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import render
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from .search_engine import SearchEngine, Mode
+from .search_engine import SearchEngine, Mode, ModeUnavailableError
+from .metrics import REGISTRY
 import json
 import threading
 
-se = SearchEngine(k=1000)
+REGISTRY.enabled = settings.SVD_METRICS_ENABLED
+# created by first request, not at import: management commands import urlconf
+# for system checks and must not start warm up (and possibly update_all) of their own
+_se = None
+_se_lock = threading.Lock()
+
+
+def get_engine() -> SearchEngine:
+    # data is loaded on background thread, /health tells which modes can be served
+    global _se
+    with _se_lock:
+        if _se is None:
+            _se = SearchEngine(k=1000, shared_model_dir=settings.SVD_SHARED_MODEL_DIR, lazy=True,
+                               n_shards=settings.SVD_SHARDS, ann_lists=settings.SVD_ANN_LISTS,
+                               ann_pq_subspaces=settings.SVD_ANN_PQ_SUBSPACES,
+                               ingest_interval=settings.SVD_INGEST_INTERVAL)
+        return _se
 
 
 def main(request):
     return render(request, 'svd/index.html')
 
 
+def metrics(request):
+    return HttpResponse(get_engine().export_metrics(), content_type='text/plain; version=0.0.4')
+
+
 class SearchQuery(APIView):
     QUERY_PARAM_NAME = 'q'
     OFFSET_PARAM_NAME = 'offset'
     MODE_PARAM_NAME = 'mode'
+    APPROXIMATE_PARAM_NAME = 'approx'
+    NPROBE_PARAM_NAME = 'nprobe'
+    TIMINGS_PARAM_NAME = 'timings'
 
     def get(self, request):
+        se = get_engine()
         query = request.GET.get(self.QUERY_PARAM_NAME)
         offset = int(request.GET.get(self.OFFSET_PARAM_NAME)) or 0
         m = request.GET.get(self.MODE_PARAM_NAME)
@@ -30,14 +57,28 @@ class SearchQuery(APIView):
                             status=status.status.HTTP_400_BAD_REQUEST)
 
         mode = Mode(m)
+        approximate = request.GET.get(
+            self.APPROXIMATE_PARAM_NAME, '0').lower() in ('1', 'true')
+        nprobe = request.GET.get(self.NPROBE_PARAM_NAME)
+        if nprobe is not None:
+            if not nprobe.isdigit() or int(nprobe) < 1:
+                return Response({'error': f'nprobe has to be positive integer, got {nprobe}'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            nprobe = int(nprobe)
+        timings = request.GET.get(
+            self.TIMINGS_PARAM_NAME, '0').lower() in ('1', 'true')
 
         if query is None:
             return Response({'error': f'Expected query parameter "{self.PARAM_NAME}"'},
                             status=status.status.HTTP_400_BAD_REQUEST)
         try:
-            response = se.handle_query(query, offset=offset, k=200, mode=mode)
+            response = se.handle_query(query, offset=offset, k=200, mode=mode,
+                                       approximate=approximate, nprobe=nprobe, timings=timings)
             response = json.dumps(response)
             return Response(response, status=status.HTTP_200_OK)
+        except ModeUnavailableError as e:
+            return Response({'error': str(e), 'modes': se.health()['modes']},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except AttributeError:
             return Response({'error': f'Failed to find any articles containing one of words from: ${query}'},
                             status=status.HTTP_404_NOT_FOUND)
@@ -50,16 +91,52 @@ class SettingsQuery(APIView):
     ORDER_NAME = 'order'
 
     def put(self, request):
+        se = get_engine()
         try:
             k = request.data[self.ORDER_NAME]
         except KeyError:
             return Response({'error': f'Expected key "mode" in request body'},
                             status=status.HTTP_400_BAD_REQUEST)
+        if isinstance(k, str) and k.isdigit():
+            k = int(k)
+        if not isinstance(k, int) or isinstance(k, bool) or k < 1:
+            return Response({'error': f'order has to be positive integer, got {k}'},
+                            status=status.HTTP_400_BAD_REQUEST)
 
         already_comptd = se.has_svd_of_order(k)
-        threading.Thread(target=se.set_low_rank_order, args=(k,)).start()
-        return Response({'computed': already_comptd}, status=status.HTTP_200_OK)
+        try:
+            job = se.request_low_rank_order(k)
+        except RuntimeError as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response({'computed': already_comptd, 'job': job}, status=status.HTTP_200_OK)
 
     def get(self, request):
+        se = get_engine()
         k = se.get_svd_order()
         return Response({'k': k}, status=status.HTTP_200_OK)
+
+
+class SettingsStatusQuery(APIView):
+    ORDER_PARAM_NAME = 'order'
+
+    def get(self, request):
+        se = get_engine()
+        # status of svd job for given order, or of all jobs
+        k = request.GET.get(self.ORDER_PARAM_NAME)
+        if k is None:
+            return Response({'jobs': se.svd_job_status(), 'k': se.get_svd_order()},
+                            status=status.HTTP_200_OK)
+        try:
+            return Response(se.svd_job_status(int(k)), status=status.HTTP_200_OK)
+        except KeyError:
+            return Response({'error': f'No svd job of order {k} was requested'},
+                            status=status.HTTP_404_NOT_FOUND)
+
+
+class HealthQuery(APIView):
+    def get(self, request):
+        se = get_engine()
+        # 200 once at least one mode can be served, 503 before that
+        health = se.health()
+        code = status.HTTP_200_OK if len(health['modes']) > 0 else status.HTTP_503_SERVICE_UNAVAILABLE
+        return Response(health, status=code)
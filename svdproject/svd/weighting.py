@@ -0,0 +1,71 @@
+import numpy as np
+import scipy.sparse as sparse
+
+# term frequency schemes, each maps (M, N) csc matrix of raw counts
+# to new values of its data array
+
+
+def raw_tf(tbd_matrix: "sparse.csc_matrix") -> "np.array":
+    return tbd_matrix.data
+
+
+def sublinear_tf(tbd_matrix: "sparse.csc_matrix") -> "np.array":
+    return 1 + np.log(tbd_matrix.data)
+
+
+def bm25_tf(tbd_matrix: "sparse.csc_matrix", k1: float = 1.2, b: float = 0.75) -> "np.array":
+    # saturates counts, longer documents need more occurrences for same weight
+    doc_lens = np.asarray(tbd_matrix.sum(axis=0)).ravel()
+    rel_lens = np.repeat(doc_lens / doc_lens.mean(), np.diff(tbd_matrix.indptr))
+    return tbd_matrix.data * (k1 + 1) / (tbd_matrix.data + k1 * (1 - b + b * rel_lens))
+
+
+# inverse document frequency schemes, each maps vector of document
+# frequencies of terms and number of documents to weights of terms
+
+
+def standard_idf(df: "np.array", N: int) -> "np.array":
+    return np.log(N / df)
+
+
+def smooth_idf(df: "np.array", N: int) -> "np.array":
+    return np.log((1 + N) / (1 + df)) + 1
+
+
+def bm25_idf(df: "np.array", N: int) -> "np.array":
+    return np.log((N - df + 0.5) / (df + 0.5) + 1)
+
+
+TF_SCHEMES = {
+    'raw': raw_tf,
+    'sublinear': sublinear_tf,
+    'bm25': bm25_tf
+}
+
+IDF_SCHEMES = {
+    'standard': standard_idf,
+    'smooth': smooth_idf,
+    'bm25': bm25_idf
+}
+
+
+def document_frequencies(tbd_matrix: "sparse.csc_matrix") -> "np.array":
+    return np.bincount(tbd_matrix.indices, minlength=tbd_matrix.shape[0])
+
+
+def apply_weighting(tbd_matrix: "sparse.csc_matrix", tf: str = 'raw',
+                    idf: str = 'standard') -> "sparse.csc_matrix":
+    # returns new (not normalized) csc matrix, data of each term row is scaled at once
+    # raises KeyError for unknown scheme
+    tf_scheme, idf_scheme = TF_SCHEMES[tf], IDF_SCHEMES[idf]
+
+    tbd_matrix = sparse.csc_matrix(tbd_matrix, copy=True)
+    tbd_matrix.eliminate_zeros()
+    N = tbd_matrix.shape[1]
+
+    # every term occurs somewhere, 1 only avoids dividing by 0 for empty rows
+    df = np.maximum(document_frequencies(tbd_matrix), 1)
+    data = tf_scheme(tbd_matrix) * idf_scheme(df, N)[tbd_matrix.indices]
+
+    return sparse.csc_matrix((data, tbd_matrix.indices, tbd_matrix.indptr),
+                             shape=tbd_matrix.shape)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
 from pathlib import Path
+import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -125,3 +126,22 @@ STATIC_URL = '/static/'
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Directory (preferably on tmpfs, e.g. /dev/shm/searchvd) with model published by
+# "manage.py publish_model", workers attach to it instead of loading their own copy
+SVD_SHARED_MODEL_DIR = os.environ.get('SVD_SHARED_MODEL_DIR')
+
+# Latency histograms and counters served at /metrics, disable with SVD_METRICS_ENABLED=0
+SVD_METRICS_ENABLED = os.environ.get('SVD_METRICS_ENABLED', '1') != '0'
+
+# Number of document shards scored in parallel by each worker, 1 disables sharding
+SVD_SHARDS = int(os.environ.get('SVD_SHARDS', '1'))
+
+# Lists and product quantization subspaces of ANN indices used by approximate queries,
+# lists default to square root of number of documents, SVD_ANN_LISTS=0 disables ANN
+SVD_ANN_LISTS = int(os.environ['SVD_ANN_LISTS']) if 'SVD_ANN_LISTS' in os.environ else None
+SVD_ANN_PQ_SUBSPACES = int(os.environ.get('SVD_ANN_PQ_SUBSPACES', '0'))
+
+# Seconds between ingests of newly crawled documents by server, 0 disables them
+# (documents are then ingested with "manage.py ingest" and picked up on restart)
+SVD_INGEST_INTERVAL = float(os.environ.get('SVD_INGEST_INTERVAL', '0'))
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'svdproject.settings')
 
 application = get_wsgi_application()
+
+# start loading engine data when server process starts instead of on first request
+from svd.views import get_engine  # noqa: E402
+
+get_engine()